@@ -1,3 +1,6 @@
 from mizuna.mizuna import Mizuna
+from mizuna.clones import CloneCache
+from mizuna.group import MizunaGroup
+from mizuna.transforms import Transform, NormalizeMetadata, RecompressPNG, CapResolution, MinifySVG
 from . import version
 __version__ = version.get_versions()['version']
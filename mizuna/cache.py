@@ -0,0 +1,489 @@
+import json
+import os
+import threading
+import time
+from typing import Optional
+from .utils.utils import verbose_print, git_blob_hash, blob_hash_bytes
+
+# NOTE: files modified within this window of the last hash may still be written to with the same mtime (coarse
+# filesystem timestamps), so their hash is computed but not cached -- the same "racy" rule git applies to its index
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+class FingerprintCache:
+
+    def __init__(self,
+                 cache_path: str):
+        """
+        FingerprintCache constructor.
+
+        Maps source files to the git blob ID of their last known content, keyed by path and invalidated by their stat
+        signature (size, mtime_ns, inode), so unchanged files are never re-read. Safe to use from several threads; use
+        fingerprints_for to share one instance per file.
+
+        Parameters
+        ----------
+        cache_path: str
+            Path of the JSON file persisting the cache
+        """
+
+        self.__cache_path = cache_path
+        self.__entries = dict()
+        self.__dirty = False
+        self.__lock = threading.Lock()
+
+        if os.path.isfile(self.__cache_path):
+            try:
+                with open(self.__cache_path, 'r') as f:
+                    self.__entries = json.load(f)
+                verbose_print(f'[mizuna] Loaded {len(self.__entries)} fingerprints from {self.__cache_path}')
+            except (OSError, ValueError):
+                verbose_print(f'[mizuna] Fingerprint cache {self.__cache_path} is unreadable -- starting empty.')
+                self.__entries = dict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def signature(st: os.stat_result) -> list:
+        """
+        Stat signature of a file
+
+        Parameters
+        ----------
+        st: os.stat_result
+            Result of os.stat on the file
+
+        Returns
+        -------
+        list
+            [size, mtime_ns, inode]
+        """
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def blob_hash(self,
+                  path: str,
+                  algorithm: str = 'sha1') -> str:
+        """
+        Get the git blob ID of a file, hashing it only if its stat signature changed
+
+        Parameters
+        ----------
+        path: str
+            Path of the file
+        algorithm: str, optional
+            Object format of the repository ('sha1' or 'sha256')
+
+        Returns
+        -------
+        str
+            Hexadecimal blob object ID
+        """
+
+        st = os.stat(path)
+        blob = self.cached(path, algorithm, st)
+        if blob is not None:
+            return blob
+
+        blob = git_blob_hash(path, algorithm)
+        self.update(path, blob, algorithm, st)
+
+        return blob
+
+    def cached(self,
+               path: str,
+               algorithm: str = 'sha1',
+               st: os.stat_result = None) -> Optional[str]:
+        """
+        Get the git blob ID of a file if it is known and the file did not change, without reading the file
+
+        Parameters
+        ----------
+        path: str
+            Path of the file
+        algorithm: str, optional
+            Object format of the repository ('sha1' or 'sha256')
+        st: os.stat_result, optional
+            Stat of the file
+
+        Returns
+        -------
+        str, optional
+            Hexadecimal blob object ID, None if unknown or outdated
+        """
+
+        st = st if st is not None else os.stat(path)
+
+        entry = self.__entries.get(os.path.abspath(path))
+        if entry is not None and entry['sig'] == self.signature(st) and entry['algorithm'] == algorithm:
+            return entry['blob']
+
+        return None
+
+    def update(self,
+               path: str,
+               blob: str,
+               algorithm: str = 'sha1',
+               st: os.stat_result = None):
+        """
+        Record the blob ID of a file whose content was hashed elsewhere
+
+        Parameters
+        ----------
+        path: str
+            Path of the file
+        blob: str
+            Hexadecimal blob object ID of the file
+        algorithm: str, optional
+            Object format of the repository ('sha1' or 'sha256')
+        st: os.stat_result, optional
+            Stat of the file taken before it was hashed
+        """
+
+        key = os.path.abspath(path)
+        st = st if st is not None else os.stat(path)
+
+        if time.time() * 10 ** 9 - st.st_mtime_ns < RACY_WINDOW_NS:
+            self.discard(path)
+            return
+
+        with self.__lock:
+            self.__entries[key] = {'sig': self.signature(st), 'algorithm': algorithm, 'blob': blob}
+            self.__dirty = True
+
+    def discard(self,
+                path: str):
+        """
+        Forget the fingerprint of a file
+
+        Parameters
+        ----------
+        path: str
+            Path of the file
+        """
+
+        with self.__lock:
+            if self.__entries.pop(os.path.abspath(path), None) is not None:
+                self.__dirty = True
+
+    def save(self):
+        """
+        Persist the cache to disk if it changed since it was loaded or last saved
+        """
+
+        with self.__lock:
+            if not self.__dirty:
+                return
+
+            tmp_path = f'{self.__cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.__entries, f)
+            os.replace(tmp_path, self.__cache_path)
+
+            self.__dirty = False
+
+
+class ContentCache:
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: Optional[int] = None):
+        """
+        ContentCache constructor.
+
+        Content-addressed store of derived files (rendered figures, transformed files): outputs are stored once by git
+        blob ID, and the keys of the inputs that produced them point to the blob. Safe to use from several threads; use
+        content_cache_for to share one instance per directory.
+
+        Parameters
+        ----------
+        directory: str
+            Directory holding the cache
+        max_bytes: int, optional
+            Maximum total size of the stored outputs; the least recently used are evicted when the cache is saved
+        """
+
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        self.__index_path = os.path.join(directory, 'index.json')
+        self.__index = dict()
+        self.__dirty = False
+        self.__lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+
+        if os.path.isfile(self.__index_path):
+            try:
+                with open(self.__index_path, 'r') as f:
+                    self.__index = json.load(f)
+            except (OSError, ValueError):
+                verbose_print(f'[mizuna] Cache index {self.__index_path} is unreadable -- starting empty.')
+
+    def __len__(self):
+        return len(self.__index)
+
+    def limit(self,
+              max_bytes: int):
+        """
+        Lower the size budget of the stored outputs, e.g., when another user of the cache asks for a smaller one
+
+        Parameters
+        ----------
+        max_bytes: int
+            Maximum total size of the stored outputs; a larger budget than the current one is ignored
+        """
+
+        with self.__lock:
+            if self.__max_bytes is None or max_bytes < self.__max_bytes:
+                self.__max_bytes = max_bytes
+
+    def __object_path(self,
+                      blob: str) -> str:
+        return os.path.join(self.__directory, 'objects', blob)
+
+    def blob(self,
+             key: str) -> Optional[str]:
+        """
+        Get the blob ID of the output stored for a key, without reading it
+
+        Parameters
+        ----------
+        key: str
+            Key of the inputs
+
+        Returns
+        -------
+        str, optional
+            SHA-1 blob ID, None if nothing is stored for the key
+        """
+
+        blob = self.__index.get(key)
+        if blob is None or not os.path.exists(self.__object_path(blob)):
+            return None
+
+        return blob
+
+    def read(self,
+             blob: str) -> Optional[bytes]:
+        """
+        Read a stored output, marking it as recently used
+
+        Parameters
+        ----------
+        blob: str
+            SHA-1 blob ID of the output
+
+        Returns
+        -------
+        bytes, optional
+            Content of the output, None if it is not stored
+        """
+
+        path = self.__object_path(blob)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        return data
+
+    def touch(self,
+              blob: str) -> bool:
+        """
+        Mark a stored output as recently used, without reading it
+
+        Parameters
+        ----------
+        blob: str
+            SHA-1 blob ID of the output
+
+        Returns
+        -------
+        bool
+            True if the output is stored
+        """
+
+        try:
+            os.utime(self.__object_path(blob))
+        except OSError:
+            return False
+
+        return True
+
+    def get(self,
+            key: str) -> Optional[tuple]:
+        """
+        Get the output stored for a key
+
+        Parameters
+        ----------
+        key: str
+            Key of the inputs
+
+        Returns
+        -------
+        tuple, optional
+            (content, SHA-1 blob ID), None if nothing is stored for the key
+        """
+
+        blob = self.__index.get(key)
+        data = self.read(blob) if blob is not None else None
+
+        return (data, blob) if data is not None else None
+
+    def put(self,
+            key: str,
+            data) -> str:
+        """
+        Store the output for a key (the index is persisted by save)
+
+        Parameters
+        ----------
+        key: str
+            Key of the inputs
+        data: bytes-like
+            Output
+
+        Returns
+        -------
+        str
+            SHA-1 git blob ID of the output
+        """
+
+        blob = blob_hash_bytes(data)
+        path = self.__object_path(blob)
+
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self.__lock:
+            self.__index[key] = blob
+            self.__dirty = True
+
+        return blob
+
+    def evict(self) -> list:
+        """
+        Remove the least recently used outputs that exceed the size budget, and the keys pointing to them
+
+        Returns
+        -------
+        list
+            Blob IDs of the evicted outputs
+        """
+
+        if self.__max_bytes is None:
+            return []
+
+        objects = []
+        for entry in os.scandir(os.path.join(self.__directory, 'objects')):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                st = entry.stat()
+                objects.append((st.st_mtime, st.st_size, entry.name))
+        total = sum(size for _, size, _ in objects)
+
+        evicted = set()
+        for _, size, blob in sorted(objects):
+            if total <= self.__max_bytes:
+                break
+            try:
+                os.remove(self.__object_path(blob))
+            except OSError:
+                continue
+            total -= size
+            evicted.add(blob)
+
+        if evicted:
+            verbose_print(f'[mizuna] Evicted {len(evicted)} cached outputs from {self.__directory}')
+            with self.__lock:
+                self.__index = {k: b for k, b in self.__index.items() if b not in evicted}
+                self.__dirty = True
+
+        return sorted(evicted)
+
+    def save(self,
+             evict: bool = True):
+        """
+        Evict outputs over the size budget, and persist the index to disk if it changed since it was loaded or last
+        saved
+
+        Parameters
+        ----------
+        evict: bool, optional
+            Evict outputs over the size budget first; pass False while outputs may still be read
+        """
+
+        if evict:
+            self.evict()
+
+        with self.__lock:
+            if not self.__dirty:
+                return
+
+            tmp_path = f'{self.__index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.__index, f)
+            os.replace(tmp_path, self.__index_path)
+
+            self.__dirty = False
+
+
+def fingerprints_for(cache_path: str) -> FingerprintCache:
+    """
+    Get the fingerprint cache persisted in a file, loading it on first use
+
+    Parameters
+    ----------
+    cache_path: str
+        Path of the JSON file persisting the cache
+
+    Returns
+    -------
+    FingerprintCache
+        The single instance shared by every Mizuna object (e.g., the members of a group) using this file, so their
+        entries are merged rather than overwriting each other when saved
+    """
+
+    key = ('fingerprints', os.path.abspath(cache_path))
+    with _caches_lock:
+        # NOTE: a cache whose file was deleted (e.g., the sync folder was reset) is loaded again
+        if key not in _caches or (len(_caches[key]) > 0 and not os.path.isfile(key[1])):
+            _caches[key] = FingerprintCache(key[1])
+        return _caches[key]
+
+
+def content_cache_for(directory: str,
+                      max_bytes: Optional[int] = None) -> ContentCache:
+    """
+    Get the content cache stored in a directory, loading it on first use
+
+    Parameters
+    ----------
+    directory: str
+        Directory holding the cache
+    max_bytes: int, optional
+        Maximum total size of the stored outputs, see ContentCache; the smallest budget asked for is kept
+
+    Returns
+    -------
+    ContentCache
+        The single instance shared by every Mizuna object using this directory
+    """
+
+    key = ('content', os.path.abspath(directory))
+    with _caches_lock:
+        if key not in _caches or not os.path.isdir(os.path.join(key[1], 'objects')):
+            _caches[key] = ContentCache(key[1], max_bytes)
+        elif max_bytes is not None:
+            _caches[key].limit(max_bytes)
+        return _caches[key]
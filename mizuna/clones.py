@@ -0,0 +1,327 @@
+import hashlib
+import os
+import re
+import shutil
+import stat
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+from .utils.utils import verbose_print
+
+try:
+    import fcntl
+except ImportError:  # Windows: clones are not locked between processes
+    fcntl = None
+
+# NOTE: clones used this recently may still be in use by another process, so they are never evicted
+EVICTION_GRACE_S = 10 * 60
+
+
+def default_cache_directory() -> str:
+    """
+    Default user-level directory holding the shared clones
+
+    Returns
+    -------
+    str
+        $XDG_CACHE_HOME/mizuna (~/.cache/mizuna), or %LOCALAPPDATA%/mizuna on Windows
+    """
+
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        return os.path.join(os.environ['LOCALAPPDATA'], 'mizuna')
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mizuna')
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a remote URL so that equivalent spellings of the same remote map to the same clone
+
+    Credentials, a trailing slash or '.git' suffix and the letter case of the host are ignored; scp-like URLs are
+    rewritten as ssh:// URLs and local paths as absolute file:// URLs.
+
+    Parameters
+    ----------
+    url: str
+        Remote URL of the git repository
+
+    Returns
+    -------
+    str
+        Normalized URL
+    """
+
+    url = url.strip()
+
+    if '://' in url:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if parts.port is not None:
+            host += f':{parts.port}'
+        path = parts.path
+        if parts.scheme.lower() == 'file':
+            path = os.path.abspath(path).replace(os.sep, '/')
+        normalized = f'{parts.scheme.lower()}://{host}{path}'
+    elif re.match(r'^([^@/:]+@)?[^/:]{2,}:', url):
+        host, _, path = url.partition(':')
+        normalized = f"ssh://{host.rpartition('@')[2].lower()}/{path.lstrip('/')}"
+    else:
+        normalized = 'file://' + os.path.abspath(url).replace(os.sep, '/')
+
+    normalized = normalized.rstrip('/')
+    if normalized.endswith('.git'):
+        normalized = normalized[:-len('.git')]
+
+    return normalized
+
+
+def _remove_readonly(func, path, _):
+    # git marks its object files read-only, which prevents their removal on Windows
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+class CloneCache:
+
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 max_clones: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 max_idle_days: Optional[float] = 30):
+        """
+        CloneCache constructor.
+
+        Holds one clone per normalized remote URL in a user-level directory, shared by every working directory and
+        process. Each clone has an advisory lock file (<clone>.lock) held while it is cloned or synced, so processes
+        sharing it take turns. Clones that have not been used recently are evicted, least recently used first, unless
+        another process holds their lock.
+
+        Parameters
+        ----------
+        directory: str, optional
+            Directory holding the clones, defaults to default_cache_directory()
+        max_clones: int, optional
+            Maximum number of clones to keep
+        max_bytes: int, optional
+            Maximum total size of the clones in bytes
+        max_idle_days: float, optional
+            Evict clones that have not been used for this many days
+        """
+
+        self.__directory = directory if directory is not None else default_cache_directory()
+        self.__max_clones = max_clones
+        self.__max_bytes = max_bytes
+        self.__max_idle_days = max_idle_days
+
+        os.makedirs(self.__directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        """
+        Get path of the directory holding the clones
+
+        Returns
+        -------
+        str
+            Path of the cache directory
+        """
+        return self.__directory
+
+    def path(self,
+             url: str) -> str:
+        """
+        Get the path of the clone of a remote, whether it exists or not
+
+        Parameters
+        ----------
+        url: str
+            Remote URL of the git repository
+
+        Returns
+        -------
+        str
+            Path of the clone
+        """
+
+        normalized = normalize_url(url)
+        name = re.sub(r'[^A-Za-z0-9._-]', '_', normalized.rpartition('/')[2]) or 'repo'
+        digest = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+        return os.path.join(self.__directory, f'{name}-{digest}')
+
+    @contextmanager
+    def locked(self,
+               url: str) -> Iterator[str]:
+        """
+        Hold the lock of the clone of a remote, waiting for other processes using it
+
+        Parameters
+        ----------
+        url: str
+            Remote URL of the git repository
+
+        Yields
+        ------
+        str
+            Path of the clone
+        """
+
+        clone = self.path(url)
+        with open(f'{clone}.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield clone
+
+    @staticmethod
+    def __try_lock(clone: str):
+
+        try:
+            f = open(f'{clone}.lock', 'a')
+        except OSError:
+            return None
+
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return None
+
+        return f
+
+    def acquire(self,
+                url: str) -> str:
+        """
+        Mark the clone of a remote as used and evict other clones over the cache budget
+
+        Parameters
+        ----------
+        url: str
+            Remote URL of the git repository
+
+        Returns
+        -------
+        str
+            Path of the clone
+        """
+
+        clone = self.touch(url)
+        self.evict(keep=clone)
+
+        return clone
+
+    def touch(self,
+              url: str) -> str:
+        """
+        Mark the clone of a remote as used, without evicting anything
+
+        Parameters
+        ----------
+        url: str
+            Remote URL of the git repository
+
+        Returns
+        -------
+        str
+            Path of the clone
+        """
+
+        clone = self.path(url)
+
+        with open(f'{clone}.used', 'a'):
+            pass
+        os.utime(f'{clone}.used')
+
+        return clone
+
+    def clones(self) -> list:
+        """
+        List the clones in the cache, most recently used first
+
+        Returns
+        -------
+        list
+            List of tuples (path, last_used_timestamp)
+        """
+
+        clones = []
+        for entry in os.scandir(self.__directory):
+            if entry.is_file() and entry.name.endswith('.used'):
+                clones.append((entry.path[:-len('.used')], entry.stat().st_mtime))
+
+        return sorted(clones, key=lambda c: c[1], reverse=True)
+
+    @staticmethod
+    def size(path: str) -> int:
+        """
+        Total size of the files in a clone
+
+        Parameters
+        ----------
+        path: str
+            Path of the clone
+
+        Returns
+        -------
+        int
+            Size in bytes
+        """
+
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.lstat(os.path.join(root, f)).st_size
+                except OSError:
+                    pass
+
+        return total
+
+    def evict(self,
+              keep: Optional[str] = None) -> list:
+        """
+        Remove the least recently used clones that exceed the cache budget, skipping those locked by another process
+
+        Parameters
+        ----------
+        keep: str, optional
+            Path of a clone that must not be evicted
+
+        Returns
+        -------
+        list
+            Paths of the evicted clones
+        """
+
+        now = time.time()
+        clones = self.clones()
+        sizes = {c: self.size(c) for c, _ in clones} if self.__max_bytes is not None else dict()
+        total = sum(sizes.values())
+
+        evicted = []
+        for rank, (clone, used) in reversed(list(enumerate(clones))):
+            if clone == keep or now - used < EVICTION_GRACE_S:
+                continue
+
+            over_count = self.__max_clones is not None and rank >= self.__max_clones
+            over_size = self.__max_bytes is not None and total > self.__max_bytes
+            idle = self.__max_idle_days is not None and now - used > self.__max_idle_days * 24 * 3600
+            if not (over_count or over_size or idle):
+                continue
+
+            lock = self.__try_lock(clone)
+            if lock is None:
+                verbose_print(f'[mizuna] Cached clone in use -- not evicting: {clone}')
+                continue
+
+            with lock:
+                verbose_print(f'[mizuna] Evicting cached clone: {clone}')
+                if os.path.isdir(clone):
+                    shutil.rmtree(clone, onerror=_remove_readonly)
+                os.remove(f'{clone}.used')
+            total -= sizes.get(clone, 0)
+            evicted.append(clone)
+
+        return evicted
@@ -0,0 +1,199 @@
+import errno
+import hashlib
+import os
+import shutil
+import sys
+from typing import Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# NOTE: _IOW(0x94, 9, int), clones the extents of a file on copy-on-write filesystems (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+BUFFER_SIZE = 1 << 20
+
+STRATEGIES = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+
+# errors meaning a strategy is not supported for this pair of files, as opposed to a failed copy (ENOTSOCK: sendfile
+# only writes to sockets outside Linux)
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF, errno.EPERM,
+               getattr(errno, 'EOPNOTSUPP', errno.EINVAL), getattr(errno, 'ENOTSUP', errno.EINVAL),
+               getattr(errno, 'ENOTSOCK', errno.EINVAL)}
+
+
+def _reflink(fsrc, fdst, size: int):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'reflink is not supported on this platform')
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc, fdst, size: int):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not supported on this platform')
+    offset = 0
+    while offset < size:
+        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _sendfile(fsrc, fdst, size: int):
+    # NOTE: os.sendfile exists on macOS and BSD, but only copies to sockets there
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, 'sendfile is not supported on this platform')
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _buffered(fsrc, fdst, size: int):
+    shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+
+
+_COPIERS = {'reflink': _reflink, 'copy_file_range': _copy_file_range, 'sendfile': _sendfile, 'buffered': _buffered}
+
+
+def strategies_for(engine: str) -> Sequence[str]:
+    """
+    Strategies tried, in order, by a copy engine
+
+    Parameters
+    ----------
+    engine: str
+        'auto' for every strategy from the cheapest to the most portable, or the name of one strategy, which falls
+        back to a buffered copy if it is not supported
+
+    Returns
+    -------
+    Sequence[str]
+        Names of the strategies
+
+    Raises
+    ------
+    Exception
+        If the engine is invalid
+    """
+
+    if engine == 'auto':
+        return STRATEGIES
+    if engine in STRATEGIES:
+        return (engine,) if engine == 'buffered' else (engine, 'buffered')
+
+    raise Exception(f'Invalid copy engine: {engine}')
+
+
+def _check_samefile(src: str,
+                    dst: str,
+                    check_samefile: bool):
+    if check_samefile and os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f'{src} and {dst} are the same file')
+
+
+def copy_file(src: str,
+              dst: str,
+              strategies: Sequence[str] = STRATEGIES,
+              check_samefile: bool = True) -> str:
+    """
+    Copy a file with its metadata, like shutil.copy2, using the cheapest strategy the filesystems support
+
+    Parameters
+    ----------
+    src: str
+        Path of the file to copy
+    dst: str
+        Path of the copy
+    strategies: Sequence[str], optional
+        Strategies to try in order: 'reflink' (copy-on-write clone), 'copy_file_range' or 'sendfile' (in-kernel copy),
+        'buffered' (userspace copy)
+    check_samefile: bool, optional
+        Raise shutil.SameFileError if src and dst are the same file
+
+    Returns
+    -------
+    str
+        Name of the strategy used
+
+    Raises
+    ------
+    OSError
+        If the copy fails, or no strategy is supported
+    """
+
+    _check_samefile(src, dst, check_samefile)
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for strategy in strategies:
+            try:
+                _COPIERS[strategy](fsrc, fdst, size)
+                break
+            except OSError as e:
+                # NOTE: a strategy that fails before writing anything is not supported, whatever the error
+                if e.errno not in UNSUPPORTED and os.fstat(fdst.fileno()).st_size > 0:
+                    raise
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        else:
+            raise OSError(errno.ENOTSUP, f'No copy strategy supported for {src}: {list(strategies)}')
+
+    shutil.copystat(src, dst)
+
+    return strategy
+
+
+def copy_and_hash(src: str,
+                  dst: str,
+                  algorithm: str = 'sha1',
+                  chunk_size: int = 8 << 20,
+                  check_samefile: bool = True) -> Tuple[Optional[str], os.stat_result]:
+    """
+    Copy a file with its metadata while computing its git blob ID, reading the source exactly once
+
+    Parameters
+    ----------
+    src: str
+        Path of the file to copy
+    dst: str
+        Path of the copy
+    algorithm: str, optional
+        Object format of the repository ('sha1' or 'sha256')
+    chunk_size: int, optional
+        Number of bytes read per chunk
+    check_samefile: bool, optional
+        Raise shutil.SameFileError if src and dst are the same file
+
+    Returns
+    -------
+    Tuple[Optional[str], os.stat_result]
+        Hexadecimal blob object ID (None if the source changed size while it was copied), and the stat of the source
+        taken before it was read
+    """
+
+    _check_samefile(src, dst, check_samefile)
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        st = os.fstat(fsrc.fileno())
+        h = hashlib.new(algorithm)
+        h.update(b'blob %d\0' % st.st_size)
+
+        # NOTE: the source is read in chunks rather than mapped, since reading a mapping of a file truncated meanwhile
+        # (e.g., a figure saved again) raises SIGBUS
+        copied = 0
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        for n in iter(lambda: fsrc.readinto(buffer), 0):
+            h.update(view[:n])
+            fdst.write(view[:n])
+            copied += n
+
+    shutil.copystat(src, dst)
+
+    return (h.hexdigest() if copied == st.st_size else None), st
@@ -1,6 +1,10 @@
+import hashlib
 import os
-from typing import List, Any, Tuple
-from .utils.utils import verbose_print, call_subprocess
+import zlib
+from typing import List, Any, Tuple, Dict, Optional
+from .utils.utils import verbose_print, call_subprocess, normalize_remote_path, blob_hash_bytes
+from .clones import normalize_url
+from .sources import MemorySource
 
 
 class Git:
@@ -8,7 +12,12 @@ class Git:
     def __init__(self,
                  repo_remote_url: str,
                  repo_local_directory: str,
-                 cwd: str):
+                 cwd: str,
+                 depth: Optional[int] = None,
+                 blob_filter: Optional[str] = None,
+                 single_branch: bool = False,
+                 sparse: bool = False,
+                 object_store: Optional[str] = None):
         """
         Git constructor.
 
@@ -20,20 +29,32 @@ class Git:
             Local directory to maintain the git repository
         cwd: str
             Current working directory
+        depth: int, optional
+            Clone only this many commits of history (shallow clone)
+        blob_filter: str, optional
+            Partial clone filter, e.g., 'blob:none' to download file contents only when they are checked out
+        single_branch: bool, optional
+            Clone only the branch the remote HEAD points to
+        sparse: bool, optional
+            Clone with a sparse checkout that only contains the files at the root of the repository
+        object_store: str, optional
+            Path of a bare repository whose objects are borrowed (git alternates) and extended by this clone
         """
 
         self.__repo_local_directory = repo_local_directory
         self.__repo_remote_url = repo_remote_url
         self.__cwd = cwd
+        self.__depth = depth
+        self.__blob_filter = blob_filter
+        self.__single_branch = single_branch
+        self.__sparse = sparse
+        self.__object_store = os.path.abspath(object_store) if object_store is not None else None
+        self.__object_format = None
 
         verbose_print(f'[mizuna] git: {self.__repo_local_directory} -- {self.__repo_remote_url}')
         verbose_print(f'[mizuna] git cwd: {self.__cwd}')
 
-        if not os.path.isdir(self.__repo_local_directory):
-            res_code, stdout, err = self.clone()
-            if res_code != 0:
-                raise Exception(f'An error occurred while cloning the repository: {err.decode()}')
-        else:
+        if not self.ensure_clone():
             verbose_print(f'[mizuna] Found existing repo in sync folder: {self.__repo_local_directory}')
 
         print(f'[mizuna] Git connection established -- directory: {self.__repo_local_directory}')
@@ -64,7 +85,9 @@ class Git:
 
     @staticmethod
     def __git(cmd_tokens: List[str],
-              cwd: str) -> Tuple[int, Any, Any]:
+              cwd: str,
+              check: bool = True,
+              input: Optional[bytes] = None) -> Tuple[int, Any, Any]:
         """
         Execute a git subprocess call
 
@@ -74,6 +97,10 @@ class Git:
             List of command tokens, e.g., ['ls', '-la']
         cwd: str
             Current working directory
+        check: bool, optional
+            Warn if the command returns a non-zero exit code
+        input: bytes, optional
+            Data sent to the standard input of git
 
         Returns
         -------
@@ -87,26 +114,102 @@ class Git:
         """
 
         env_vars = os.environ
-        return call_subprocess(['git'] + cmd_tokens, cwd, check=True, shell=False, env=dict(env_vars))
+        return call_subprocess(['git'] + cmd_tokens, cwd, check=check, shell=False, env=dict(env_vars), input=input)
+
+    def ensure_clone(self) -> bool:
+        """
+        Clone the repository if the local directory does not exist (e.g., a shared clone that was evicted)
+
+        Returns
+        -------
+        bool
+            True if the repository was cloned
+        """
+
+        if os.path.isdir(self.__repo_local_directory):
+            return False
+
+        res_code, stdout, err = self.clone()
+        if res_code != 0:
+            raise Exception(f'An error occurred while cloning the repository: {err.decode()}')
+        self.share_objects()
+
+        return True
 
     def clone(self) -> Tuple[int, Any, Any]:
         """
         Clone the Overleaf git repository
 
+        Shallow, partial and single-branch clones keep the history and objects downloaded proportional to the current
+        tree. Later pulls and pushes work on them unchanged: pulls only fetch commits after the shallow boundary, and
+        missing blobs are fetched on demand when they are checked out.
+
         Returns
         -------
         Tuple[int, Any, Any]
             Output from the git command
         """
 
-        verbose_print('[mizuna] Cloning git repository...')
-        res_code, stdout, err = self.__git(['clone', self.__repo_remote_url, self.__repo_local_directory], self.__cwd)
+        options = []
+        if self.__depth is not None:
+            options += [f'--depth={self.__depth}']
+        if self.__blob_filter is not None:
+            options += [f'--filter={self.__blob_filter}']
+        if self.__single_branch:
+            options += ['--single-branch']
+        if self.__sparse:
+            options += ['--sparse']
+        if self.__object_store is not None:
+            self.__init_object_store()
+            options += ['--reference-if-able', self.__object_store]
+
+        verbose_print(f"[mizuna] Cloning git repository... {' '.join(options)}")
+        res_code, stdout, err = self.__git(['clone'] + options + [self.__repo_remote_url, self.__repo_local_directory],
+                                           self.__cwd)
 
         if res_code != 0:
             raise Exception(err)
 
         return res_code, stdout, err
 
+    def __init_object_store(self):
+
+        if os.path.isdir(self.__object_store):
+            return
+
+        verbose_print(f'[mizuna] Creating shared object store: {self.__object_store}')
+        res_code, stdout, err = self.__git(['init', '--quiet', '--bare', self.__object_store], self.__cwd)
+        if res_code != 0:
+            raise Exception(err)
+
+        # objects borrowed by clones must never be pruned, and shallow clones must be able to contribute
+        for key, value in [('gc.pruneExpire', 'never'), ('receive.shallowUpdate', 'true')]:
+            self.__git(['config', key, value], self.__object_store)
+
+    def share_objects(self) -> Optional[Tuple[int, Any, Any]]:
+        """
+        Contribute the objects of this clone to the shared object store, so other clones can borrow them
+
+        The objects are kept reachable in the store by a ref named after the remote, refs/mizuna/<hash of remote URL>.
+
+        Returns
+        -------
+        Tuple[int, Any, Any], optional
+            Output from the git command, None if no object store is used
+        """
+
+        if self.__object_store is None:
+            return None
+
+        key = hashlib.sha1(normalize_url(self.__repo_remote_url).encode()).hexdigest()
+        res_code, stdout, err = self.__git(['push', '--quiet', '--no-verify', self.__object_store,
+                                            f'+HEAD:refs/mizuna/{key}'], self.__repo_local_directory, check=False)
+
+        if res_code != 0:
+            verbose_print(f'[mizuna] Could not share objects with {self.__object_store}: {err}')
+
+        return res_code, stdout, err
+
     def add(self,
             file: str) -> Tuple[int, Any, Any]:
         """
@@ -130,6 +233,65 @@ class Git:
 
         return res_code, stdout, err
 
+    def add_all(self,
+                files: List[str]) -> Tuple[int, Any, Any]:
+        """
+        Add changes to many files to the git repository in a single git call
+
+        Paths are passed through standard input rather than the command line, so any number of files can be staged.
+
+        Parameters
+        ----------
+        files: list
+            Files to add to the staging area
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Output from the git command
+        """
+
+        pathspec = b'\0'.join(f.encode() for f in files)
+        res_code, stdout, err = self.__git(['add', '--pathspec-from-file=-', '--pathspec-file-nul'],
+                                           self.__repo_local_directory, input=pathspec)
+
+        if res_code != 0:
+            raise Exception(err)
+
+        return res_code, stdout, err
+
+    def has_staged_changes(self) -> bool:
+        """
+        Check whether the staging area differs from HEAD
+
+        Returns
+        -------
+        bool
+            True if there are changes to commit
+        """
+
+        res_code, stdout, err = self.__git(['diff', '--cached', '--quiet'], self.__repo_local_directory, check=False)
+
+        return res_code != 0
+
+    def ahead(self) -> int:
+        """
+        Count the local commits that have not been pushed to the upstream branch
+
+        Returns
+        -------
+        int
+            Number of commits ahead of upstream, 0 if there is no upstream
+        """
+
+        res_code, stdout, err = self.__git(['rev-list', '--count', '@{upstream}..HEAD'],
+                                           self.__repo_local_directory, check=False)
+
+        try:
+            return int(stdout) if res_code == 0 else 0
+        except (TypeError, ValueError):
+            return 0
+
     def commit(self) -> Tuple[int, Any, Any]:
         """
         Commit changes to the git repository
@@ -147,6 +309,266 @@ class Git:
 
         return res_code, stdout, err
 
+    def ls_tree(self,
+                rev: str = 'HEAD') -> Dict[str, str]:
+        """
+        List all blobs committed in a revision of the git repository
+
+        Parameters
+        ----------
+        rev: str, optional
+            Revision to list
+
+        Returns
+        -------
+        Dict[str, str]
+            Dictionary where { remote_path: blob_object_id }, empty if the revision does not exist
+        """
+
+        res_code, stdout, err = self.__git(['ls-tree', '-r', '-z', '--full-tree', rev], self.__repo_local_directory)
+
+        if res_code != 0:
+            verbose_print(f'[mizuna] Could not list {rev}, treating all files as changed.')
+            return dict()
+
+        if isinstance(stdout, bytes):
+            stdout = stdout.decode('utf-8', errors='surrogateescape')
+
+        tree = dict()
+        for entry in stdout.split('\0'):
+            meta, _, path = entry.partition('\t')
+            meta = meta.split(' ')
+            if len(meta) != 3 or meta[1] != 'blob' or not path:
+                continue
+            tree[path] = meta[2]
+
+        return tree
+
+    @property
+    def __stale_list(self) -> str:
+        return os.path.join(self.__repo_local_directory, '.git', 'mizuna-stale')
+
+    @staticmethod
+    def __lines(output: Any) -> List[str]:
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', errors='surrogateescape')
+        return output.split()
+
+    def commit_files(self,
+                     files: Dict[str, str]) -> Optional[Tuple[int, Any, Any]]:
+        """
+        Commit files straight from their source paths or memory, without copying them into the working tree
+
+        Blobs are written from the sources with hash-object, the index is updated with update-index, and the commit is
+        created with write-tree and commit-tree. The working tree copies of the committed files are only refreshed
+        before the next operation that needs them (see refresh_worktree).
+
+        Parameters
+        ----------
+        files: dict
+            Dictionary where { file_path or MemorySource: remote_path }
+
+        Returns
+        -------
+        Tuple[int, Any, Any], optional
+            Output from the git command that moved HEAD, None if the files did not change the tree
+        """
+
+        paths = [f for f in files if not isinstance(f, MemorySource)]
+        memory = [f for f in files if isinstance(f, MemorySource)]
+        remotes = [normalize_remote_path(files[f]) for f in paths + memory]
+
+        blobs = []
+        if paths:
+            stdin_paths = '\n'.join(os.path.abspath(f) for f in paths).encode()
+            res_code, stdout, err = self.__git(['hash-object', '-w', '--stdin-paths'], self.__repo_local_directory,
+                                               input=stdin_paths)
+            if res_code != 0:
+                raise Exception(err)
+            blobs += self.__lines(stdout)
+        blobs += [self.write_blob(f.buffer) for f in memory]
+
+        index_info = b''.join(f'100644 {b}\t{r}'.encode() + b'\0' for b, r in zip(blobs, remotes))
+        res_code, stdout, err = self.__git(['update-index', '-z', '--index-info'], self.__repo_local_directory,
+                                           input=index_info)
+        if res_code != 0:
+            raise Exception(err)
+
+        with open(self.__stale_list, 'ab') as f:
+            f.write(b''.join(r.encode() + b'\0' for r in remotes))
+
+        res_code, stdout, err = self.__git(['write-tree'], self.__repo_local_directory)
+        if res_code != 0:
+            raise Exception(err)
+        tree = self.__lines(stdout)[0]
+
+        res_code, stdout, err = self.__git(['rev-parse', 'HEAD', 'HEAD^{tree}'], self.__repo_local_directory)
+        if res_code != 0:
+            raise Exception(err)
+        head, head_tree = self.__lines(stdout)
+
+        if tree == head_tree:
+            return None
+
+        res_code, stdout, err = self.__git(['commit-tree', tree, '-p', head, '-m', 'Update from Mizuna'],
+                                           self.__repo_local_directory)
+        if res_code != 0:
+            raise Exception(err)
+        commit = self.__lines(stdout)[0]
+
+        res_code, stdout, err = self.__git(['update-ref', '-m', 'commit: Update from Mizuna', 'HEAD', commit, head],
+                                           self.__repo_local_directory)
+        if res_code != 0:
+            raise Exception(err)
+
+        verbose_print(f'[mizuna] Committed {len(remotes)} files as {commit}')
+
+        return res_code, stdout, err
+
+    @property
+    def object_format(self) -> str:
+        """
+        Get the object format (hash algorithm) of the repository
+
+        Returns
+        -------
+        str
+            'sha1' or 'sha256'
+        """
+
+        if self.__object_format is None:
+            res_code, stdout, err = self.__git(['rev-parse', '--show-object-format'], self.__repo_local_directory,
+                                               check=False)
+            lines = self.__lines(stdout) if res_code == 0 else []
+            self.__object_format = 'sha256' if lines == ['sha256'] else 'sha1'
+
+        return self.__object_format
+
+    def read_blob(self,
+                  blob: str) -> bytes:
+        """
+        Read the content of a blob from the object store (fetched on demand in partial clones)
+
+        Parameters
+        ----------
+        blob: str
+            Hexadecimal blob object ID
+
+        Returns
+        -------
+        bytes
+            Content of the blob
+
+        Raises
+        ------
+        Exception
+            If the blob cannot be read
+        """
+
+        res_code, stdout, err = self.__git(['cat-file', 'blob', blob], self.__repo_local_directory, check=False)
+        if res_code != 0:
+            raise Exception(err)
+
+        return stdout
+
+    def write_blob(self,
+                   data) -> str:
+        """
+        Write in-memory content to the object store as a loose blob, without a git subprocess
+
+        Parameters
+        ----------
+        data: bytes-like
+            Content of the blob
+
+        Returns
+        -------
+        str
+            Hexadecimal blob object ID
+        """
+
+        data = memoryview(data)
+        blob = blob_hash_bytes(data, self.object_format)
+
+        directory = os.path.join(self.__repo_local_directory, '.git', 'objects', blob[:2])
+        path = os.path.join(directory, blob[2:])
+        if os.path.exists(path):
+            return blob
+
+        os.makedirs(directory, exist_ok=True)
+        compressor = zlib.compressobj(1)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(compressor.compress(b'blob %d\0' % data.nbytes))
+            f.write(compressor.compress(data))
+            f.write(compressor.flush())
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+
+        return blob
+
+    def refresh_worktree(self):
+        """
+        Write the files committed by commit_files out to the working tree
+        """
+
+        if not os.path.isfile(self.__stale_list):
+            return
+
+        with open(self.__stale_list, 'rb') as f:
+            stale = f.read()
+
+        res_code, stdout, err = self.__git(['checkout-index', '-f', '-z', '--stdin'], self.__repo_local_directory,
+                                           input=stale)
+        if res_code != 0:
+            raise Exception(err)
+
+        os.remove(self.__stale_list)
+
+    def sparse_checkout(self,
+                        directories: List[str]) -> Tuple[int, Any, Any]:
+        """
+        Restrict the working tree to the files at the root of the repository and the given directories (cone mode)
+
+        Parameters
+        ----------
+        directories: list
+            Directories to check out, relative to the root of the repository
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Output from the git command
+        """
+
+        res_code, stdout, err = self.__git(['sparse-checkout', 'set', '--cone', '--stdin'], self.__repo_local_directory,
+                                           input='\n'.join(directories).encode())
+
+        if res_code != 0:
+            raise Exception(err)
+
+        return res_code, stdout, err
+
+    def sparse_directories(self) -> Optional[List[str]]:
+        """
+        Get the directories of the sparse checkout (cone mode)
+
+        Returns
+        -------
+        list, optional
+            Directories checked out besides the files at the root, None if the working tree is not sparse
+        """
+
+        res_code, stdout, err = self.__git(['sparse-checkout', 'list'], self.__repo_local_directory, check=False)
+
+        if res_code != 0:
+            return None
+
+        if isinstance(stdout, bytes):
+            stdout = stdout.decode('utf-8', errors='replace')
+
+        return [d for d in stdout.splitlines() if d.strip()]
+
     def pull(self) -> Tuple[int, Any, Any]:
         """
         Pull changes from the git repository
@@ -157,6 +579,7 @@ class Git:
             Output from the git command
         """
 
+        self.refresh_worktree()
         res_code, stdout, err = self.__git(['pull'], self.__repo_local_directory)
 
         if res_code != 0:
@@ -180,3 +603,86 @@ class Git:
             raise Exception(err)
 
         return res_code, stdout, err
+
+    def fetch(self) -> Tuple[int, Any, Any]:
+        """
+        Fetch changes from the git repository without merging them
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Output from the git command
+        """
+
+        res_code, stdout, err = self.__git(['fetch'], self.__repo_local_directory)
+
+        if res_code != 0:
+            raise Exception(err)
+
+        return res_code, stdout, err
+
+    def rebase(self) -> Tuple[int, Any, Any]:
+        """
+        Rebase local commits onto the upstream branch, aborting the rebase if it does not apply cleanly
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Output from the git command
+        """
+
+        self.refresh_worktree()
+        res_code, stdout, err = self.__git(['rebase', '@{upstream}'], self.__repo_local_directory)
+
+        if res_code != 0:
+            self.__git(['rebase', '--abort'], self.__repo_local_directory, check=False)
+            raise Exception(err)
+
+        return res_code, stdout, err
+
+    @staticmethod
+    def __push_rejected(output: Any) -> bool:
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', errors='replace')
+        return isinstance(output, str) and ('[rejected]' in output or 'non-fast-forward' in output)
+
+    def push_rebase(self,
+                    attempts: int = 3) -> Tuple[int, Any, Any]:
+        """
+        Push changes to the git repository, fetching and rebasing only if the push is rejected as non-fast-forward
+
+        Parameters
+        ----------
+        attempts: int, optional
+            Maximum number of push attempts
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Output from the git command
+
+        Raises
+        ------
+        Exception
+            If attempts is less than 1, the push fails for another reason, the rebase conflicts, or every attempt is
+            rejected
+        """
+
+        if attempts < 1:
+            raise Exception(f'Invalid number of push attempts: {attempts}')
+
+        for attempt in range(1, attempts + 1):
+            res_code, stdout, err = self.__git(['push'], self.__repo_local_directory, check=False)
+
+            if res_code == 0:
+                return res_code, stdout, err
+            if not self.__push_rejected(err):
+                raise Exception(err)
+            if attempt == attempts:
+                break
+
+            verbose_print(f'[mizuna] Push rejected (attempt {attempt}/{attempts}) -- fetching and rebasing.')
+            self.fetch()
+            self.rebase()
+
+        raise Exception(f'Push rejected after {attempts} attempts: {err}')
@@ -0,0 +1,114 @@
+import os
+import time
+import warnings
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .mizuna import Mizuna
+from .cache import fingerprints_for
+from .tracker import Tracker
+from .utils.utils import verbose_print
+
+SyncReport = namedtuple('SyncReport', ['result', 'error', 'seconds'])
+
+
+class MizunaGroup(Tracker):
+
+    def __init__(self,
+                 remotes: dict,
+                 max_workers: int = 4,
+                 **kwargs):
+        """
+        MizunaGroup constructor.
+
+        Syncs one set of tracked files to several repositories (e.g., a paper, a poster and a slide deck) concurrently.
+
+        Parameters
+        ----------
+        remotes: dict
+            Dictionary where { repo_local_directory: repo_remote_url }
+        max_workers: int
+            Maximum number of repositories cloned or synced at the same time
+        kwargs
+            Keyword arguments passed to the Mizuna constructor of every repository
+        """
+
+        super().__init__()
+
+        if len(remotes) == 0:
+            raise Exception('No remotes passed.')
+
+        self.__max_workers = max_workers
+
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as pool:
+            futures = {d: pool.submit(Mizuna, url, d, **kwargs) for d, url in remotes.items()}
+            self.__members = {d: f.result() for d, f in futures.items()}
+
+        self.__fingerprints = fingerprints_for(os.path.join('.mizuna', 'fingerprints.json'))
+
+    def __str__(self):
+
+        return '\n'.join(str(m) for m in self.__members.values())
+
+    @property
+    def members(self):
+        """
+        Returns the Mizuna object of every repository
+
+        Returns
+        -------
+        dict
+            Dictionary where { repo_local_directory: Mizuna }
+        """
+        return self.__members
+
+    @staticmethod
+    def __sync_member(member: Mizuna,
+                      files: dict,
+                      hashes: dict) -> SyncReport:
+
+        start = time.perf_counter()
+        try:
+            result = member._sync_files(files, hashes)
+            return SyncReport(result, None, time.perf_counter() - start)
+        except Exception as e:
+            return SyncReport(None, e, time.perf_counter() - start)
+
+    def sync(self):
+        """
+        Sync all tracked files to every repository concurrently
+
+        Each source is hashed once for all repositories. A failure in one repository does not stop the others.
+
+        Returns
+        -------
+        dict
+            Dictionary where { repo_local_directory: SyncReport(result, error, seconds) }
+        """
+
+        files = self.expand()
+        if len(files) == 0:
+            warnings.warn('Mizuna has no files to sync.', RuntimeWarning)
+            return dict()
+
+        hashes = dict()
+        for src in files:
+            if not isinstance(src, str):
+                continue
+            try:
+                hashes[src] = self.__fingerprints.blob_hash(src)
+            except OSError:
+                # NOTE: each repository reports the files it cannot read
+                pass
+        self.__fingerprints.save()
+
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as pool:
+            futures = {d: pool.submit(self.__sync_member, m, files, hashes) for d, m in self.__members.items()}
+            report = {d: f.result() for d, f in futures.items()}
+
+        for d, r in report.items():
+            if r.error is None:
+                verbose_print(f'[mizuna] {d}: synced in {r.seconds:.2f}s')
+            else:
+                print(f'[mizuna] {d}: sync failed after {r.seconds:.2f}s -- {r.error}')
+
+        return report
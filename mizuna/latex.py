@@ -0,0 +1,170 @@
+import json
+import os
+import posixpath
+import re
+import warnings
+from typing import Callable, Dict, Optional, Set
+from .utils.utils import verbose_print, normalize_remote_path
+
+# extensions graphicx tries, in order, when \includegraphics names a file without one (pdfLaTeX, plus EPS and SVG)
+GRAPHICS_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.mps', '.jbig2', '.jb2', '.eps', '.svg')
+
+COMMENT = re.compile(r'(?<!\\)%.*')
+DOCUMENT_CLASS = re.compile(r'\\documentclass\b')
+INCLUDE_GRAPHICS = re.compile(r'\\includegraphics\*?\s*(?:\[[^\]]*\]\s*)*\{([^}]*)\}')
+INPUT = re.compile(r'\\(?:input|include|subfile)\s*\{([^}]*)\}')
+GRAPHICS_PATH = re.compile(r'\\graphicspath\s*\{((?:\s*\{[^}]*\})*)\s*\}')
+GRAPHICS_PATH_ENTRY = re.compile(r'\{([^}]*)\}')
+
+
+def parse_tex(source: str) -> dict:
+    """
+    Extract the references of a LaTeX file
+
+    Parameters
+    ----------
+    source: str
+        Content of the file
+
+    Returns
+    -------
+    dict
+        { 'root': bool (has a \\documentclass), 'graphics': [names], 'inputs': [names], 'graphicspath': [dirs] }
+    """
+
+    source = COMMENT.sub('', source)
+
+    return {'root': DOCUMENT_CLASS.search(source) is not None,
+            'graphics': [g.strip() for g in INCLUDE_GRAPHICS.findall(source)],
+            'inputs': [i.strip() for i in INPUT.findall(source)],
+            'graphicspath': [d.strip() for p in GRAPHICS_PATH.findall(source) for d in GRAPHICS_PATH_ENTRY.findall(p)]}
+
+
+def graphics_candidates(name: str,
+                        directories: list) -> Set[str]:
+    """
+    Paths an \\includegraphics name may resolve to
+
+    Parameters
+    ----------
+    name: str
+        Name passed to \\includegraphics
+    directories: list
+        Directories of \\graphicspath
+
+    Returns
+    -------
+    Set[str]
+        Normalized remote paths, with and without the implicit extensions
+    """
+
+    candidates = set()
+    for directory in [''] + directories:
+        path = normalize_remote_path(posixpath.join(directory, name))
+        candidates.add(path)
+        candidates.update(path + ext for ext in GRAPHICS_EXTENSIONS)
+
+    return candidates
+
+
+class LatexIndex:
+
+    def __init__(self,
+                 cache_path: str):
+        """
+        LatexIndex constructor.
+
+        Index of the files referenced by the LaTeX documents of a project, starting from the files with a
+        \\documentclass and following \\input, \\include and \\subfile. Parsed files are cached by blob ID, so only
+        .tex files that changed since the last pull are read and parsed again.
+
+        Parameters
+        ----------
+        cache_path: str
+            Path of the JSON file persisting the parsed files
+        """
+
+        self.__cache_path = cache_path
+        self.__parsed = dict()
+
+        if os.path.isfile(self.__cache_path):
+            try:
+                with open(self.__cache_path, 'r') as f:
+                    self.__parsed = json.load(f)
+            except (OSError, ValueError):
+                verbose_print(f'[mizuna] LaTeX index {self.__cache_path} is unreadable -- starting empty.')
+
+    def referenced(self,
+                   tree: Dict[str, str],
+                   read: Callable[[str], bytes]) -> Optional[Set[str]]:
+        """
+        Get the paths referenced by the documents of a project
+
+        Parameters
+        ----------
+        tree: Dict[str, str]
+            Dictionary where { path: blob_id } of the files of the project
+        read: Callable
+            Function returning the content of a blob
+
+        Returns
+        -------
+        Set[str], optional
+            Normalized paths that graphics and inputs may resolve to, None if a graphics name contains a macro or a
+            macro parameter (e.g., \\figdir/a or #1), which cannot be resolved without running LaTeX
+        """
+
+        tex = {path: blob for path, blob in tree.items() if path.lower().endswith('.tex')}
+
+        reparsed = 0
+        for blob in set(tex.values()) - set(self.__parsed):
+            self.__parsed[blob] = parse_tex(read(blob).decode('utf-8', errors='replace'))
+            reparsed += 1
+        verbose_print(f'[mizuna] Parsed {reparsed} of {len(tex)} LaTeX files.')
+
+        # NOTE: without a \documentclass (e.g., a project of fragments), every file counts as a root
+        pending = [path for path, blob in tex.items() if self.__parsed[blob]['root']] or list(tex)
+        visited = set()
+        referenced = set()
+        directories = []
+        graphics = []
+        while pending:
+            path = pending.pop()
+            if path in visited or path not in tex:
+                continue
+            visited.add(path)
+
+            parsed = self.__parsed[tex[path]]
+            directories += [d for d in parsed['graphicspath'] if d not in directories]
+            graphics += parsed['graphics']
+            for name in parsed['inputs']:
+                name = normalize_remote_path(name)
+                referenced.update({name, name + '.tex'})
+                pending += [name, name + '.tex']
+
+        self.__save(set(tex.values()), reparsed > 0)
+
+        unresolved = sorted({name for name in graphics if '\\' in name or '#' in name})
+        if unresolved:
+            warnings.warn(f'Graphics included through macros cannot be resolved: {unresolved} -- syncing all figures.',
+                          RuntimeWarning)
+            return None
+
+        for name in graphics:
+            referenced |= graphics_candidates(name, directories)
+
+        return referenced
+
+    def __save(self,
+               blobs: set,
+               changed: bool):
+
+        if not changed and set(self.__parsed) <= blobs:
+            return
+
+        self.__parsed = {blob: parsed for blob, parsed in self.__parsed.items() if blob in blobs}
+
+        tmp_path = f'{self.__cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.__parsed, f)
+        os.replace(tmp_path, self.__cache_path)
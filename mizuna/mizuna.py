@@ -1,28 +1,57 @@
+import asyncio
+import contextlib
+import functools
 import os
+import pickle
+import posixpath
 import shutil
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
 # from ._version import __version__
 from .git import Git
+from .cache import fingerprints_for, content_cache_for
+from .clones import CloneCache
 import mizuna.utils
-from .utils.utils import verbose_print, all_of_type
+from .tracker import Tracker
+from .rules import RegexPattern
+from .sources import MemorySource
+from .render import RenderReport, fingerprint, render
+from .perceptual import PerceptualComparator
+from .transforms import apply_chain, stage_key
+from .latex import LatexIndex, GRAPHICS_EXTENSIONS
+from .worker import worker_for
+from .watch import Watcher
+from .copying import copy_file, copy_and_hash, strategies_for
+from .utils.utils import verbose_print, normalize_remote_path
 import warnings
 
 
-# NOTE: this hook into shutil._samefile will force all files to be considered different, thus overwriting
-# networked drives considers two files in the same directory equal, this hook is needed so files can be copied
-def samefile_network_hook(*args, **kwargs):
-    return False
-
-
-samefile_original_func = shutil._samefile
-
-
-class Mizuna:
+class Mizuna(Tracker):
 
     def __init__(self,
                  repo_remote_url: str,
                  repo_local_directory: str,
                  networked_drive: bool = False,
-                 verbose: bool = False):
+                 verbose: bool = False,
+                 optimistic: bool = False,
+                 push_attempts: int = 3,
+                 engine: str = 'worktree',
+                 clone_depth: int = None,
+                 clone_filter: str = None,
+                 single_branch: bool = False,
+                 sparse: bool = False,
+                 clone_cache: CloneCache = None,
+                 object_store: str = None,
+                 copy_workers: int = 8,
+                 copy_engine: str = None,
+                 copy_chunk_size: int = 8 << 20,
+                 transforms: list = None,
+                 transform_workers: int = None,
+                 transform_executor: str = 'thread',
+                 transform_cache_bytes: int = 1 << 30,
+                 perceptual_tolerance: float = None,
+                 referenced_only: bool = False,
+                 render_cache_bytes: int = 1 << 30):
 
         """
         Mizuna constructor.
@@ -37,44 +66,147 @@ class Mizuna:
             True if the local directory is a networked drive
         verbose: bool
             Print verbose output
+        optimistic: bool
+            Skip the pull before syncing, and only fetch and rebase if the push is rejected
+        push_attempts: int
+            Maximum number of push attempts when syncing optimistically
+        engine: str
+            How changed files are committed: 'worktree' copies them into the local directory and runs git add,
+            'plumbing' writes them into the git object store straight from their source paths
+        clone_depth: int
+            Clone only this many commits of history (shallow clone)
+        clone_filter: str
+            Partial clone filter, e.g., 'blob:none' to download file contents only when they are checked out
+        single_branch: bool
+            Clone only the default branch of the remote
+        sparse: bool
+            Only check out the files at the root of the remote and the directories tracked files are synced into
+        clone_cache: CloneCache
+            Shared cache to keep the clone in, instead of the local directory in the sync folder
+        object_store: str
+            Path of a bare repository shared by all clones, which borrow its objects and contribute theirs to it
+        copy_workers: int
+            Number of files copied into the local directory at the same time
+        copy_engine: str
+            How files are copied into the local directory: 'auto' tries a copy-on-write reflink, then an in-kernel
+            copy (copy_file_range, sendfile), then a buffered copy; 'reflink', 'copy_file_range', 'sendfile' or
+            'buffered' try one strategy before falling back to a buffered copy; 'copy2' uses shutil.copy2;
+            'single_pass' reads each file once, hashing it while it is copied. Defaults to 'single_pass' on networked
+            drives and 'auto' otherwise
+        copy_chunk_size: int
+            Number of bytes read per chunk by the 'single_pass' engine
+        transforms: list
+            Transforms applied in order to the tracked files they apply to before they are hashed and committed, e.g.,
+            [NormalizeMetadata()] so that re-rendered figures with new timestamps are not committed again
+        transform_workers: int
+            Number of files transformed at the same time, defaults to the number of CPUs
+        transform_executor: str
+            'thread' runs transforms on a thread pool, 'process' in worker processes (for transforms written in pure
+            Python, which must then be picklable)
+        transform_cache_bytes: int
+            Maximum total size of the cached outputs of transforms in .mizuna/transforms
+        perceptual_tolerance: float
+            Compare PNG files to their committed version by their pixels, and skip them if at most this fraction of
+            pixels differs visibly (e.g., 0.001); requires NumPy and Pillow
+        referenced_only: bool
+            Only sync the figures (graphics files) that the LaTeX files of the project include with \\includegraphics,
+            following \\input, \\include and \\graphicspath
+        render_cache_bytes: int
+            Maximum total size of the cached renders of figures in .mizuna/renders
         """
 
+        if engine not in ('worktree', 'plumbing'):
+            raise Exception(f'Invalid engine: {engine}')
+        if push_attempts < 1:
+            raise Exception(f'Invalid number of push attempts: {push_attempts}')
+        if transform_executor not in ('thread', 'process'):
+            raise Exception(f'Invalid transform executor: {transform_executor}')
+        if copy_engine is None:
+            copy_engine = 'single_pass' if networked_drive else 'auto'
+        self._copy_strategies = strategies_for(copy_engine) if copy_engine not in ('copy2', 'single_pass') else None
+
         mizuna.utils.verbose = verbose
         self.version = mizuna.__version__
 
-        self.__files_tracked = dict()
+        super().__init__()
 
         self._repo_remote_url = repo_remote_url
         self._mizuna_sync_dir = '.mizuna'
         self._repo_local_directory = repo_local_directory
-        full_local_directory = os.path.join(self._mizuna_sync_dir, self._repo_local_directory)
+        self._optimistic = optimistic
+        self._push_attempts = push_attempts
+        self._engine = engine
+        self._copy_workers = copy_workers
+        self._copy_engine = copy_engine
+        self._copy_chunk_size = copy_chunk_size
+        self._networked_drive = networked_drive
+        self._transforms = list(transforms or [])
+        self._transform_workers = transform_workers or os.cpu_count() or 1
+        self._transform_executor = transform_executor
+        self._transform_cache_bytes = transform_cache_bytes
+        self.__transformed = None
+        self.__entry_transforms = dict()
+        self.__rule_transforms = dict()
+        self._referenced_only = referenced_only
+        self.__latex = None
+        self.__copy_report = dict()
+        self.__render_report = dict()
+        self._sparse = sparse
+        self.__sparse_directories = set()
+        self.__clone_cache = clone_cache
+        self.__renders = None
+        self._render_cache_bytes = render_cache_bytes
 
         verbose_print(f'[mizuna] v{self.version}')
         verbose_print(f'[mizuna] cwd: {os.getcwd()}')
 
         if networked_drive:
-            warnings.warn(f'A bug in Python (see https://bugs.python.org/issue33935) prevents files in networked drives'
-                          f'from copying properly.'
-                          f'Mizuna will prevent a crucial routine in the copying method from running.'
+            warnings.warn(f'A bug in Python (see https://bugs.python.org/issue33935) prevents files in networked drives '
+                          f'from copying properly. '
+                          f'Mizuna will skip the check for copying a file onto itself when copying tracked files. '
                           f'This will allow the metadata of same files to be updated and overwritten.', RuntimeWarning)
-            shutil._samefile = samefile_network_hook
 
         if os.path.isdir(self._mizuna_sync_dir):
             verbose_print(f'[mizuna] Sync folder {self._mizuna_sync_dir}/ exists.')
             verbose_print(f'[mizuna] Consider adding {self._mizuna_sync_dir}/ to your .gitignore if using VC.')
         else:
             verbose_print(f'[mizuna] Sync folder {self._mizuna_sync_dir}/ does not exist -- creating.')
-            os.mkdir(self._mizuna_sync_dir)
+            os.makedirs(self._mizuna_sync_dir, exist_ok=True)
 
         verbose_print(f'[mizuna] Sync folder (absolute): {os.path.join(os.getcwd(), self._mizuna_sync_dir)}')
 
-        verbose_print(f'[mizuna] Remote URL: {self._repo_remote_url}')
-        verbose_print(f'[mizuna] Local directory: {os.path.join(self._mizuna_sync_dir, self._repo_local_directory)}')
+        self.__fingerprints = fingerprints_for(os.path.join(self._mizuna_sync_dir, 'fingerprints.json'))
+        self.__perceptual = None
+        if perceptual_tolerance is not None:
+            self.__perceptual = PerceptualComparator(os.path.join(self._mizuna_sync_dir, 'thumbnails'),
+                                                     perceptual_tolerance)
+
+        with contextlib.ExitStack() as stack:
+            if self.__clone_cache is not None:
+                full_local_directory = stack.enter_context(self.__clone_cache.locked(self._repo_remote_url))
+                self.__clone_cache.acquire(self._repo_remote_url)
+            else:
+                full_local_directory = os.path.join(self._mizuna_sync_dir, self._repo_local_directory)
+
+            verbose_print(f'[mizuna] Remote URL: {self._repo_remote_url}')
+            verbose_print(f'[mizuna] Local directory: {full_local_directory}')
+
+            print('[mizuna] Connecting to git...')
+            self.__bridge = Git(repo_remote_url, full_local_directory, os.getcwd(),
+                                depth=clone_depth, blob_filter=clone_filter, single_branch=single_branch,
+                                sparse=sparse, object_store=object_store)
+            self.__worker = worker_for(self.__bridge.local_directory)
+            self.__watcher = None
 
-        print('[mizuna] Connecting to git...')
-        self.__bridge = Git(repo_remote_url, full_local_directory, os.getcwd())
+            if self._sparse:
+                # NOTE: an existing cone is kept, so the tracked directories are not removed and checked out again
+                directories = self.__bridge.sparse_directories()
+                if directories is None:
+                    self.__bridge.sparse_checkout([])
+                else:
+                    self.__sparse_directories = set(directories)
 
-        self.__bridge.pull()
+            self.__bridge.pull()
 
     def __str__(self):
 
@@ -84,28 +216,28 @@ class Mizuna:
         return return_string
 
     @property
-    def track_list(self):
+    def copy_report(self):
         """
-        Returns the list of files tracked
+        Returns the copy strategy used for each file copied during the last sync
 
         Returns
         -------
-        list
-            List of files tracked
+        dict
+            Dictionary where { file_path: strategy }
         """
-        return self.__files_tracked
+        return self.__copy_report
 
     @property
-    def track_count(self):
+    def render_report(self):
         """
-        Returns the number of files tracked
+        Returns the outcome of each job of the last render_many
 
         Returns
         -------
-        int
-            Number of files tracked
+        dict
+            Dictionary where { remote_path: RenderReport(blob, error, seconds, cached) }
         """
-        return len(self.__files_tracked)
+        return self.__render_report
 
     @property
     def git(self):
@@ -120,7 +252,8 @@ class Mizuna:
         return self.__bridge
 
     def track(self,
-              *args):
+              *args,
+              transforms: list = None):
 
         """
         Tracks a single or set of files, with optional renaming on the remote
@@ -128,11 +261,16 @@ class Mizuna:
         Parameters
         ----------
         args
-            - The path of a single file
-            - The path of a single file, the path of its rename on the remote
-            - A list of file paths
-            - A list of tuple containing file paths and rename paths
-            - A dictionary where { file_path: remote_path }
+            See Tracker.track
+        transforms: list, optional
+            Transforms applied in order to these files (or the files a pattern matches) before they are synced, instead
+            of the transforms passed to the constructor ([] to sync them unchanged); kept if the files are tracked again
+            without transforms
+
+        Returns
+        -------
+        list
+            List of tuples (file, remote_path) of the entries tracked
 
         Raises
         ------
@@ -140,112 +278,643 @@ class Mizuna:
             If arguments not enough, too many, or invalid
         """
 
-        if len(args) == 0:
-            raise Exception('Not enough arguments.')
-        if len(args) > 2:
-            raise Exception('Too many arguments.')
+        tracked = super().track(*args)
 
-        files = args[0]
-        rename = args[1] if len(args) == 2 else None
+        if transforms is not None:
+            for _, remote in tracked:
+                self.__entry_transforms[normalize_remote_path(remote)] = list(transforms)
+            entries = args[0] if isinstance(args[0], (list, dict)) else [args[0]]
+            patterns = {rule.pattern for rule in self.rules}
+            for entry in entries:
+                entry = entry[0] if isinstance(entry, tuple) else entry
+                if isinstance(entry, (str, RegexPattern)) and entry in patterns:
+                    self.__rule_transforms[entry] = list(transforms)
 
-        # single file
-        if isinstance(files, str) and rename is None:
-            self.__track_single(files)
+        if self._sparse:
+            self.__update_sparse_checkout(self.track_list)
 
-        # single file with rename
-        elif isinstance(files, str) and rename is not None:
-            self.__track_single(files, rename)
+        return tracked
 
-        # list of files or tuples
-        elif isinstance(files, list) and rename is None:
-            if all_of_type(files, str):
-                for f in files:
-                    self.__track_single(f)
-            elif all_of_type(files, tuple):
-                for f in files:
-                    self.__track_single(f[0], f[1])
-            else:
-                raise Exception('Invalid type passed in list.')
+    def figure(self,
+               remote_path: str,
+               format: str = None):
+        """
+        Decorator tracking the figure returned by a plotting function, rendered only when its inputs change
 
-        # dictionary
-        elif isinstance(files, dict) and rename is None:
-            self.__track_multiple_dict(files)
+        Each call is fingerprinted from the source code of the function and its arguments (NumPy arrays and pandas
+        objects are hashed through their buffers, without copies). Rendered outputs are cached by content under the
+        sync folder: a call with a known fingerprint reuses the cached bytes without calling the function, and since
+        their blob ID is known the sync skips them without hashing if they match HEAD.
 
-        # invalid type
-        else:
-            raise Exception('Invalid arguments passed.')
+        Parameters
+        ----------
+        remote_path: str
+            Path of the figure on the remote
+        format: str, optional
+            Format the figure is rendered in, defaults to the extension of the remote path
 
-    def __track_single(self,
-                       file: str,
-                       remote: str = ''):
+        Returns
+        -------
+        Callable
+            Decorator; the decorated function returns the rendered bytes
 
-        if not isinstance(remote, str):
-            raise Exception('Remote is not a string.') # TODO: better error message
+        Raises
+        ------
+        Exception
+            If the function returns something that is not a figure or bytes-like data
+        """
 
-        if remote == '':
-            self.__files_tracked.update({file: file})
-        else:
-            self.__files_tracked.update({file: remote})
+        format = format or posixpath.splitext(remote_path)[1][1:].lower() or 'png'
 
-    def __track_multiple_dict(self,
-                              files: dict):
+        def decorator(func):
 
-        for f, r in files.items():
-            self.__track_single(f, r)
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = fingerprint(func, args, kwargs, format)
+                source = self.__cached_render(key, remote_path, format)
+                if source is None:
+                    rendered = MemorySource(func(*args, **kwargs), remote_path, format)
+                    source = self.__track_render(key, rendered.buffer, remote_path, format)
+                    self.__renders.save()
 
-    def untrack(self, file):
+                return source.buffer.tobytes()
+
+            return wrapper
+
+        return decorator
+
+    def render_many(self,
+                    jobs: list,
+                    max_workers: int = None,
+                    sync: bool = True):
         """
-        Untracks a single file
+        Render many figures in parallel worker processes, track them, and sync them in one commit
+
+        Each job calls a plotting function in a process pool (matplotlib is not thread safe); the rendered bytes are
+        sent back to this process, without temporary files, and tracked at the remote path. Jobs whose fingerprint is
+        in the render cache are not rendered again (see figure). Jobs that fail are reported and not tracked. The
+        outcome of each job is available in render_report.
 
         Parameters
         ----------
-        file: str
-            The file to untrack
+        jobs: list
+            List of tuples (plotting function, tuple of arguments, remote path); functions must be picklable (defined
+            at module level) and return a figure with a savefig method or bytes-like data
+        max_workers: int, optional
+            Number of worker processes, defaults to the number of CPUs
+        sync: bool, optional
+            Sync all tracked files once the figures are rendered
 
-        Raises
-        ------
-        KeyError
-            If the file is not found
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Result code from git operations, None if sync is False
         """
 
-        self.__files_tracked.pop(file)
-        print(f'[mizuna] {file} untracked.')
+        reports = dict()
+        pending = dict()
+        for func, args, remote in jobs:
+            format = posixpath.splitext(remote)[1][1:].lower() or 'png'
+            key = fingerprint(func, args, {}, format)
+            source = self.__cached_render(key, remote, format)
+            if source is not None:
+                reports[remote] = RenderReport(source.blob_hash(), None, 0.0, True)
+                continue
+
+            # NOTE: a job that cannot be pickled would never reach a worker (and hangs the pool on Python 3.6)
+            try:
+                pickle.dumps((func, args))
+            except Exception as e:
+                reports[remote] = RenderReport(None, f'{type(e).__name__}: {e}', 0.0, False)
+                continue
+
+            pending[remote] = (func, args, format, key)
+
+        if pending:
+            workers = min(max_workers or os.cpu_count() or 1, len(pending))
+            verbose_print(f'[mizuna] Rendering {len(pending)} figures on {workers} processes.')
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {remote: pool.submit(render, func, args, {}, remote, format)
+                           for remote, (func, args, format, key) in pending.items()}
+                for remote, future in futures.items():
+                    try:
+                        data, error, seconds = future.result()
+                    except Exception as e:
+                        # NOTE: the job never ran, e.g., a crashed worker
+                        data, error, seconds = None, f'{type(e).__name__}: {e}', 0.0
+
+                    blob = None
+                    if error is None:
+                        func, args, format, key = pending[remote]
+                        blob = self.__track_render(key, data, remote, format).blob_hash()
+                    reports[remote] = RenderReport(blob, error, seconds, False)
+
+        if self.__renders is not None:
+            self.__renders.save()
+        self.__render_report = reports
+
+        errors = {r: report.error for r, report in reports.items() if report.error is not None}
+        if errors:
+            warnings.warn(f'{len(errors)} figures could not be rendered and were not tracked:\n' +
+                          '\n'.join(f'  {r}: {e}' for r, e in errors.items()), RuntimeWarning)
+
+        return self.sync() if sync else None
+
+    def __cached_render(self,
+                        key: str,
+                        remote: str,
+                        format: str) -> Optional[MemorySource]:
+
+        if self.__renders is None:
+            self.__renders = content_cache_for(os.path.join(self._mizuna_sync_dir, 'renders'),
+                                               self._render_cache_bytes)
+
+        cached = self.__renders.get(key)
+        if cached is None:
+            return None
+
+        verbose_print(f'[mizuna] {remote} unchanged -- reusing cached render.')
+        data, blob = cached
+        source = MemorySource(data, remote, format, blob=blob)
+        self.track(source, remote)
+
+        return source
+
+    def __track_render(self,
+                       key: str,
+                       data,
+                       remote: str,
+                       format: str) -> MemorySource:
+
+        blob = self.__renders.put(key, data)
+        source = MemorySource(data, remote, format, blob=blob)
+        self.track(source, remote)
+
+        return source
+
+    def __update_sparse_checkout(self,
+                                 files: dict):
+
+        directories = {posixpath.dirname(normalize_remote_path(r)) for r in files.values()}
+        directories.discard('')
+
+        if directories <= self.__sparse_directories:
+            return
 
-    def untrack_all(self):
-        """
-        Untracks all the files
-        """
+        self.__sparse_directories |= directories
+        verbose_print(f'[mizuna] Sparse checkout: {sorted(self.__sparse_directories)}')
+        self.__bridge.sparse_checkout(sorted(self.__sparse_directories))
+
+    def __blob_hash(self,
+                    src: str,
+                    algorithm: str,
+                    hashes: dict = None,
+                    read: bool = True) -> str:
 
-        self.__files_tracked.clear()
-        print(f'[mizuna] All files untracked.')
+        if isinstance(src, MemorySource):
+            return src.blob_hash(algorithm)
+
+        if hashes is not None and algorithm == 'sha1' and src in hashes:
+            return hashes[src]
+
+        if not read:
+            return self.__fingerprints.cached(src, algorithm)
+
+        return self.__fingerprints.blob_hash(src, algorithm)
 
     def sync(self):
         """
         Add all tracked files to the git staging area, commit, and push to the repository
 
+        Files whose content matches the blob already committed at HEAD are skipped, and all changed files are staged
+        in a single git call. If nothing changed and there are no unpushed commits, nothing is committed or pushed.
+
+        In optimistic mode the pull is skipped: changes are committed on top of the last known HEAD and pushed
+        immediately, and the remote is only fetched and rebased onto if the push is rejected.
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Result code from git operations
+        """
+
+        return self._sync_files(self.expand())
+
+    def sync_async(self) -> Future:
+        """
+        Sync all tracked files on a background thread, without blocking the caller
+
+        The tracked files are snapshotted when the sync is requested. Syncs of the same clone run one at a time; if
+        sync_async is called again while a sync is in flight, the requests are coalesced into one follow-up sync of the
+        latest snapshot. Pending syncs still run if the script ends before they finish: the interpreter waits for them
+        before exiting.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future resolved with the result of the sync, see sync
+        """
+
+        files = self.expand()
+        return self.__worker.submit(id(self), lambda: self.__sync_files(files))
+
+    async def sync_awaitable(self):
+        """
+        Sync all tracked files on a background thread, awaitable from asyncio code (see sync_async)
+
+        Returns
+        -------
+        Tuple[int, Any, Any]
+            Result code from git operations
+        """
+
+        return await asyncio.wrap_future(self.sync_async())
+
+    def watch(self,
+              debounce: float = 1.0,
+              poll_interval: float = 0.5,
+              backend: str = 'auto'):
+        """
+        Sync automatically whenever tracked files change, until stop_watching is called
+
+        Bursts of writes (e.g., a figure saved in several chunks) are debounced into one background sync (see
+        sync_async) once the files have been quiet for the debounce window.
+
+        Parameters
+        ----------
+        debounce: float
+            Seconds without changes before syncing
+        poll_interval: float
+            Seconds between checks for changes
+        backend: str
+            'inotify', 'poll', or 'auto' to use inotify where available (Linux) and stat polling otherwise
+        """
+
+        if self.__watcher is not None and self.__watcher.running:
+            print('[mizuna] Already watching tracked files.')
+            return
+
+        self.__watcher = Watcher(lambda: [f for f in self.expand() if isinstance(f, str)], self.__sync_watched,
+                                 debounce, poll_interval, backend)
+        self.__watcher.start()
+        print(f'[mizuna] Watching tracked files for changes ({self.__watcher.backend}).')
+
+    def stop_watching(self):
+        """
+        Stop syncing automatically on changes
+        """
+
+        if self.__watcher is None:
+            return
+
+        self.__watcher.stop()
+        self.__watcher = None
+        print('[mizuna] Stopped watching tracked files.')
+
+    def __sync_watched(self):
+
+        verbose_print('[mizuna] Tracked files changed -- syncing.')
+        self.sync_async().add_done_callback(self.__report_watched)
+
+    @staticmethod
+    def __report_watched(future: Future):
+
+        if future.exception() is not None:
+            print(f'[mizuna] Sync after change failed: {future.exception()}')
+
+    def __copy_files(self,
+                     files: dict,
+                     algorithms: dict) -> dict:
+        """
+        Copy files into the local directory on a thread pool
+
+        Parameters
+        ----------
+        files: dict
+            Dictionary where { file_path: remote_path }
+        algorithms: dict
+            Dictionary where { file_path: object_format } of the repository blobs the files are compared to
+
+        Returns
+        -------
+        Tuple[dict, dict]
+            Dictionary where { file_path: blob_id } of the files copied successfully, with the blob ID computed while
+            copying (single_pass engine) or None, and dictionary where { file_path: exception } of the failures
+        """
+
+        directories = set()
+
+        def copy(src, rename):
+            copy_path = os.path.join(self.__bridge.local_directory, rename)
+            directory = os.path.dirname(copy_path)
+            if directory not in directories:
+                os.makedirs(directory, exist_ok=True)
+                directories.add(directory)
+            if isinstance(src, MemorySource):
+                with open(copy_path, 'wb') as f:
+                    f.write(src.buffer)
+                return 'memory', None
+            if self._copy_engine == 'single_pass':
+                algorithm = algorithms.get(src, 'sha1')
+                blob, st = copy_and_hash(src, copy_path, algorithm, self._copy_chunk_size,
+                                         check_samefile=not self._networked_drive)
+                if blob is not None:
+                    self.__fingerprints.update(src, blob, algorithm, st)
+                return 'single_pass', blob
+            if self._copy_engine == 'copy2' and not self._networked_drive:
+                shutil.copy2(src, copy_path)
+                return 'copy2', None
+            strategy = copy_file(src, copy_path, self._copy_strategies or ('buffered',),
+                                 check_samefile=not self._networked_drive)
+            return strategy, None
+
+        with ThreadPoolExecutor(max_workers=self._copy_workers) as pool:
+            futures = {src: pool.submit(copy, src, rename) for src, rename in files.items()}
+
+        errors = {src: f.exception() for src, f in futures.items() if f.exception() is not None}
+        copied = {src: f.result() for src, f in futures.items() if src not in errors}
+        self.__copy_report = {src: strategy for src, (strategy, _) in copied.items()}
+        if self.__copy_report:
+            counts = {s: list(self.__copy_report.values()).count(s) for s in set(self.__copy_report.values())}
+            verbose_print(f'[mizuna] Copied {len(self.__copy_report)} files: {counts}')
+
+        return {src: blob for src, (_, blob) in copied.items()}, errors
+
+    def __referenced_files(self,
+                           files: dict,
+                           committed: dict) -> dict:
+
+        if self.__latex is None:
+            self.__latex = LatexIndex(os.path.join(self._mizuna_sync_dir, 'latex.json'))
+
+        referenced = self.__latex.referenced(committed, self.__bridge.read_blob)
+        if referenced is None:
+            return files
+        kept = {src: rename for src, rename in files.items()
+                if normalize_remote_path(rename) in referenced or
+                posixpath.splitext(rename)[1].lower() not in GRAPHICS_EXTENSIONS}
+        if len(kept) < len(files):
+            verbose_print(f'[mizuna] Skipping {len(files) - len(kept)} figures not referenced by the LaTeX project.')
+
+        return kept
+
+    def __visually_unchanged(self,
+                             src,
+                             rename: str,
+                             blob: str,
+                             source_blob: str = None) -> bool:
+
+        if self.__perceptual is None or not rename.lower().endswith('.png'):
+            return False
+
+        try:
+            if isinstance(src, MemorySource):
+                data = src.buffer
+            else:
+                with open(src, 'rb') as f:
+                    data = f.read()
+        except OSError:
+            return False
+
+        return self.__perceptual.unchanged(data, blob, self.__bridge.read_blob, source_blob)
+
+    def __transform_chain(self,
+                          src,
+                          rename: str) -> list:
+
+        chain = self.__entry_transforms.get(normalize_remote_path(rename))
+        if chain is None and isinstance(src, str) and src not in self.track_list:
+            chain = next((self.__rule_transforms[rule.pattern] for rule in self.rules
+                          if rule.pattern in self.__rule_transforms and rule.matches(src)), None)
+        if chain is None:
+            chain = self._transforms
+
+        return [t for t in chain if t.applies(rename)]
+
+    def __transform_files(self,
+                          files: dict,
+                          hashes: dict = None) -> dict:
+        """
+        Apply the transform chain of each tracked file, orchestrated on a thread pool
+
+        The output of each stage is cached by the blob ID of its input and the name and options of the transform, so a
+        stage only runs when its input or options change. Unchanged sources are not read (see FingerprintCache), and
+        the cached output of their chain is only read if it differs from HEAD and must be committed. With the
+        'process' executor, transforms run in worker processes.
+
+        Parameters
+        ----------
+        files: dict
+            Dictionary where { file_path: remote_path }
+        hashes: dict, optional
+            Dictionary where { file_path: sha1_blob_id } of sources already hashed by the caller
+
+        Returns
+        -------
+        dict
+            Dictionary where { file_path: remote_path }, with transformed files replaced by their in-memory output;
+            files that cannot be read are left for the copy to report, and failed transforms are warned about
+        """
+
+        if self.__transformed is None:
+            self.__transformed = content_cache_for(os.path.join(self._mizuna_sync_dir, 'transforms'),
+                                                   self._transform_cache_bytes)
+
+        def load(blob):
+            data = self.__transformed.read(blob)
+            if data is None:
+                raise OSError(f'Cached transform output {blob} was evicted')
+            return data
+
+        def transform(src, rename, chain, processes):
+            try:
+                source_blob = self.__blob_hash(src, 'sha1', hashes)
+            except OSError:
+                return src
+
+            # skip the leading stages whose output is cached
+            blob, stage = source_blob, 0
+            while stage < len(chain):
+                cached = self.__transformed.blob(stage_key(blob, chain[stage]))
+                if cached is None:
+                    break
+                blob, stage = cached, stage + 1
+
+            if stage == len(chain) and self.__transformed.touch(blob):
+                return MemorySource(functools.partial(load, blob), rename, blob=blob, origin=src)
+
+            data = self.__transformed.read(blob) if stage > 0 else None
+            if data is None:
+                blob, stage = source_blob, 0
+                if isinstance(src, MemorySource):
+                    data = src.buffer.tobytes()
+                else:
+                    with open(src, 'rb') as f:
+                        data = f.read()
+            if stage == len(chain):
+                return MemorySource(data, rename, blob=blob, origin=src)
+
+            remaining = chain[stage:]
+            if processes is not None:
+                outputs = processes.submit(apply_chain, remaining, data, rename).result()
+            else:
+                outputs = apply_chain(remaining, data, rename)
+            verbose_print(f'[mizuna] {src} transformed by {[t.name for t in remaining]}')
+
+            for t, output in zip(remaining, outputs):
+                blob = self.__transformed.put(stage_key(blob, t), output)
+
+            return MemorySource(outputs[-1], rename, blob=blob, origin=src)
+
+        transformed = dict()
+        processes = ProcessPoolExecutor(self._transform_workers) if self._transform_executor == 'process' else None
+        try:
+            with ThreadPoolExecutor(max_workers=self._transform_workers) as pool:
+                futures = dict()
+                for src, rename in files.items():
+                    chain = self.__transform_chain(src, rename)
+                    if chain:
+                        futures[src] = pool.submit(transform, src, rename, chain, processes)
+                    else:
+                        transformed[src] = rename
+        finally:
+            if processes is not None:
+                processes.shutdown()
+
+        errors = {src: f.exception() for src, f in futures.items() if f.exception() is not None}
+        for src, future in futures.items():
+            transformed[src if src in errors else future.result()] = files[src]
+        if errors:
+            warnings.warn(f'{len(errors)} files could not be transformed and are synced unchanged:\n' +
+                          '\n'.join(f'{src}: {e}' for src, e in errors.items()), RuntimeWarning)
+
+        # NOTE: evicted once the sync has read the outputs it needs, see __sync_clone
+        self.__transformed.save(evict=False)
+
+        return transformed
+
+    def _sync_files(self,
+                    files: dict,
+                    hashes: dict = None):
+        """
+        Sync a set of files to the repository (see sync)
+
+        Parameters
+        ----------
+        files: dict
+            Dictionary where { file_path: remote_path }
+        hashes: dict, optional
+            Dictionary where { file_path: sha1_blob_id } of sources already hashed by the caller
+
         Returns
         -------
         Tuple[int, Any, Any]
             Result code from git operations
         """
-        self.__bridge.pull()
+        with self.__worker.lock:
+            return self.__sync_files(files, hashes)
+
+    def __sync_files(self,
+                     files: dict,
+                     hashes: dict = None):
+
+        if self.__clone_cache is None:
+            return self.__sync_clone(files, hashes)
+
+        # NOTE: the shared clone is locked for the whole sync, so other processes neither sync nor evict it meanwhile
+        with self.__clone_cache.locked(self._repo_remote_url):
+            self.__clone_cache.touch(self._repo_remote_url)
+            if self.__bridge.ensure_clone():
+                print('[mizuna] Shared clone was evicted -- cloned again.')
+                if self._sparse:
+                    self.__bridge.sparse_checkout(sorted(self.__sparse_directories))
+
+            return self.__sync_clone(files, hashes)
+
+    def __sync_clone(self,
+                     files: dict,
+                     hashes: dict = None):
 
-        if self.track_count == 0:
+        if self._sparse:
+            self.__update_sparse_checkout(files)
+
+        if not self._optimistic:
+            self.__bridge.pull()
+
+        if len(files) == 0:
             warnings.warn('Mizuna has no files to sync.', RuntimeWarning)
             return
 
-        res1 = None
-        for src, rename in self.__files_tracked.items():
+        committed = self.__bridge.ls_tree()
+
+        if self._referenced_only:
+            files = self.__referenced_files(files, committed)
+
+        if self._transforms or self.__entry_transforms or self.__rule_transforms:
+            files = self.__transform_files(files, hashes)
+
+        # the single_pass engine hashes files while copying them, so only already known hashes are compared here
+        single_pass = self._engine == 'worktree' and self._copy_engine == 'single_pass'
+
+        changed = dict()
+        algorithms = dict()
+        errors = dict()
+        for src, rename in files.items():
             copy_path = os.path.join(self.__bridge.local_directory, rename)
             verbose_print(f'Source: {src} -> Rename: {rename} -- Remote path: {copy_path}')
 
-            if not os.path.exists(os.path.dirname(copy_path)):
-                os.makedirs(os.path.dirname(copy_path), exist_ok=True)
-            shutil.copy2(src, copy_path)
-
-            res1 = self.__bridge.add(rename)
+            blob = committed.get(normalize_remote_path(rename))
+            algorithm = 'sha256' if blob is not None and len(blob) == 64 else 'sha1'
+            try:
+                source_blob = None
+                if blob is not None:
+                    source_blob = self.__blob_hash(src, algorithm, hashes, read=not single_pass)
+            except OSError as e:
+                errors[src] = e
+                continue
+            if blob is not None and blob == source_blob:
+                verbose_print(f'[mizuna] {src} unchanged -- skipping.')
+                continue
+            if blob is not None and self.__visually_unchanged(src, rename, blob, source_blob):
+                verbose_print(f'[mizuna] {src} visually unchanged -- skipping.')
+                continue
+
+            changed[src] = rename
+            algorithms[src] = algorithm
+
+        if self._engine == 'worktree':
+            copied, copy_errors = self.__copy_files(changed, algorithms)
+            errors.update(copy_errors)
+            changed = {src: rename for src, rename in changed.items()
+                       if src in copied and (copied[src] is None or
+                                             copied[src] != committed.get(normalize_remote_path(rename)))}
+
+        if errors:
+            warnings.warn(f'{len(errors)} files could not be read or copied and were not synced:\n' +
+                          '\n'.join(f'{src}: {e}' for src, e in errors.items()), RuntimeWarning)
+
+        self.__fingerprints.save()
+
+        res1 = res2 = None
+        if changed and self._engine == 'plumbing':
+            res2 = self.__bridge.commit_files(changed)
+        elif changed:
+            res1 = self.__bridge.add_all(list(changed.values()))
+            if self.__bridge.has_staged_changes():
+                res2 = self.__bridge.commit()
+
+        if self.__transformed is not None:
+            self.__transformed.save()
+
+        if res2 is None and self.__bridge.ahead() == 0:
+            print('[mizuna] All tracked files are up to date -- nothing to sync.')
+            return res1 or (0, b'', b'')
+
+        if self._optimistic:
+            res3 = self.__bridge.push_rebase(self._push_attempts)
+        else:
+            res3 = self.__bridge.push()
 
-        res2 = self.__bridge.commit()
-        res3 = self.__bridge.push()
+        self.__bridge.share_objects()
 
         return res1 or res2 or res3
@@ -0,0 +1,200 @@
+import io
+import math
+import os
+from typing import Callable, Optional, Tuple
+from .utils.utils import verbose_print
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is installed with matplotlib
+    Image = None
+
+# NOTE: images are compared as thumbnails no larger than this on their longest side, so comparisons are cheap and
+# sub-pixel rendering noise averages out
+THUMBNAIL_SIZE = 512
+
+# difference of a channel, on a 0-255 scale, above which a thumbnail pixel counts as changed
+PIXEL_THRESHOLD = 16
+
+
+def decode(data) -> 'numpy.ndarray':
+    """
+    Decode an image into RGBA pixels
+
+    Parameters
+    ----------
+    data: bytes-like
+        Content of the image file
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (height, width, 4) of uint8
+    """
+
+    with Image.open(io.BytesIO(data)) as image:
+        return numpy.asarray(image.convert('RGBA'))
+
+
+def thumbnail(pixels: 'numpy.ndarray',
+              size: int = THUMBNAIL_SIZE) -> 'numpy.ndarray':
+    """
+    Downsample an image by averaging blocks of pixels
+
+    Parameters
+    ----------
+    pixels: numpy.ndarray
+        Array of shape (height, width, channels)
+    size: int, optional
+        Maximum size of the longest side of the thumbnail
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (height / factor, width / factor, channels) of float32, where factor is the smallest integer
+        that fits the thumbnail in size (edges are padded to a multiple of it)
+    """
+
+    height, width, channels = pixels.shape
+    factor = max(1, math.ceil(max(height, width) / size))
+    if factor == 1:
+        return pixels.astype(numpy.float32)
+
+    padded = numpy.pad(pixels, ((0, -height % factor), (0, -width % factor), (0, 0)), mode='edge')
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor, channels)
+
+    return blocks.mean(axis=(1, 3), dtype=numpy.float32)
+
+
+class PerceptualComparator:
+
+    def __init__(self,
+                 directory: str,
+                 tolerance: float = 0.001,
+                 threshold: int = PIXEL_THRESHOLD,
+                 size: int = THUMBNAIL_SIZE):
+        """
+        PerceptualComparator constructor.
+
+        Compares raster images to committed versions by their pixels rather than their bytes. Thumbnails of committed
+        versions are cached on disk by blob ID, so each committed version is decoded once.
+
+        Parameters
+        ----------
+        directory: str
+            Directory holding the cached thumbnails
+        tolerance: float, optional
+            Fraction of thumbnail pixels allowed to differ for images to be considered unchanged
+        threshold: int, optional
+            Difference of a channel (0-255) above which a thumbnail pixel counts as different
+        size: int, optional
+            Maximum size of the longest side of the thumbnails
+
+        Raises
+        ------
+        ImportError
+            If NumPy or Pillow is not installed
+        """
+
+        if numpy is None or Image is None:
+            raise ImportError('Perceptual change detection requires NumPy and Pillow.')
+
+        self.__directory = directory
+        self.__tolerance = tolerance
+        self.__threshold = threshold
+        self.__size = size
+        self.__verdicts = dict()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __thumbnail_path(self,
+                         blob: str) -> str:
+        return os.path.join(self.__directory, f'{blob}-{self.__size}.npz')
+
+    def committed_thumbnail(self,
+                            blob: str,
+                            read: Callable[[str], bytes]) -> Tuple[tuple, 'numpy.ndarray']:
+        """
+        Get the thumbnail of a committed image, decoding it only if it is not cached
+
+        Parameters
+        ----------
+        blob: str
+            Hexadecimal blob object ID of the committed image
+        read: Callable
+            Function returning the content of a blob
+
+        Returns
+        -------
+        Tuple[tuple, numpy.ndarray]
+            Shape of the full image, and its thumbnail
+        """
+
+        path = self.__thumbnail_path(blob)
+        if os.path.isfile(path):
+            try:
+                with numpy.load(path) as cached:
+                    return tuple(cached['shape']), cached['thumbnail']
+            except (OSError, ValueError, KeyError):
+                verbose_print(f'[mizuna] Thumbnail {path} is unreadable -- decoding again.')
+
+        pixels = decode(read(blob))
+        shape, small = pixels.shape, thumbnail(pixels, self.__size)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            numpy.savez(f, shape=numpy.array(shape), thumbnail=small)
+        os.replace(tmp_path, path)
+
+        return shape, small
+
+    def unchanged(self,
+                  data,
+                  blob: str,
+                  read: Callable[[str], bytes],
+                  source_blob: Optional[str] = None) -> bool:
+        """
+        Checks if an image looks the same as its committed version
+
+        Parameters
+        ----------
+        data: bytes-like
+            Content of the new image
+        blob: str
+            Hexadecimal blob object ID of the committed image
+        read: Callable
+            Function returning the content of a blob
+        source_blob: str, optional
+            Blob object ID of the new image, to remember the verdict for this pair of images
+
+        Returns
+        -------
+        bool
+            True if the fraction of differing thumbnail pixels is within tolerance; False if the images differ in
+            size or either cannot be decoded
+        """
+
+        if source_blob is not None and (source_blob, blob) in self.__verdicts:
+            return self.__verdicts[(source_blob, blob)]
+
+        try:
+            shape, committed = self.committed_thumbnail(blob, read)
+            pixels = decode(data)
+        except Exception as e:
+            verbose_print(f'[mizuna] Cannot compare images perceptually ({e}) -- comparing bytes.')
+            return False
+
+        unchanged = False
+        if pixels.shape == shape:
+            different = numpy.abs(thumbnail(pixels, self.__size) - committed).max(axis=-1) > self.__threshold
+            unchanged = float(different.mean()) <= self.__tolerance
+
+        if source_blob is not None:
+            self.__verdicts[(source_blob, blob)] = unchanged
+
+        return unchanged
@@ -0,0 +1,156 @@
+import hashlib
+import inspect
+import pickle
+import sys
+import time
+from collections import namedtuple
+from typing import Any, Callable, Optional, Tuple
+from .sources import MemorySource
+
+# Outcome of one render_many job: blob ID of the render (None if it failed), error message, seconds spent rendering,
+# and whether the render was reused from the cache
+RenderReport = namedtuple('RenderReport', ['blob', 'error', 'seconds', 'cached'])
+
+
+def _update_buffer(h, view: memoryview):
+    if view.c_contiguous:
+        h.update(view)
+    else:
+        h.update(view.tobytes())
+
+
+def _update_array(h, array):
+    h.update(f'ndarray:{array.dtype.str}:{array.shape}'.encode())
+    if array.dtype.hasobject:
+        _update(h, array.tolist())
+        return
+    try:
+        _update_buffer(h, memoryview(array))
+    except (TypeError, ValueError):
+        h.update(array.tobytes())
+
+
+def _update(h, obj: Any):
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        view = memoryview(obj)
+        h.update(f'buffer:{view.nbytes};'.encode())
+        _update_buffer(h, view)
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}:{len(obj)}['.encode())
+        for x in obj:
+            _update(h, x)
+        h.update(b']')
+    elif isinstance(obj, dict):
+        h.update(f'dict:{len(obj)}{{'.encode())
+        for k in sorted(obj, key=repr):
+            _update(h, k)
+            _update(h, obj[k])
+        h.update(b'}')
+    elif hasattr(obj, 'columns') and hasattr(obj, 'index') and hasattr(obj, 'to_numpy'):
+        # pandas DataFrame: columns are hashed one by one, so each is a zero-copy view of its block
+        h.update(f'dataframe:{obj.shape}'.encode())
+        _update(h, list(obj.columns))
+        _update(h, obj.index)
+        for column in obj.columns:
+            _update_array(h, obj[column].to_numpy())
+    elif hasattr(obj, 'to_numpy') and hasattr(obj, 'dtype'):
+        # pandas Series and Index
+        h.update(f'{type(obj).__name__}:{getattr(obj, "name", None)!r}'.encode())
+        if hasattr(obj, 'index'):
+            _update(h, obj.index)
+        _update_array(h, obj.to_numpy())
+    elif hasattr(obj, '__array_interface__') and hasattr(obj, 'dtype') and hasattr(obj, 'shape'):
+        _update_array(h, obj)
+    else:
+        try:
+            h.update(pickle.dumps(obj, protocol=4))
+        except Exception:
+            h.update(repr(obj).encode())
+
+
+def fingerprint(func: Callable,
+                args: tuple,
+                kwargs: dict,
+                format: str = '') -> str:
+    """
+    Fingerprints a call to a plotting function
+
+    NumPy arrays and pandas objects are hashed through their buffers without copying them. The source code of the
+    function is part of the fingerprint, but the globals and closures it reads are not.
+
+    Parameters
+    ----------
+    func: Callable
+        Plotting function
+    args: tuple
+        Positional arguments of the call
+    kwargs: dict
+        Keyword arguments of the call
+    format: str, optional
+        Format the output is rendered in
+
+    Returns
+    -------
+    str
+        Hexadecimal fingerprint
+    """
+
+    h = hashlib.blake2b(digest_size=20)
+
+    try:
+        source = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = getattr(func, '__code__', None)
+        source = code.co_code + repr(code.co_consts).encode() if code is not None else repr(func).encode()
+    h.update(f'{getattr(func, "__module__", "")}.{getattr(func, "__qualname__", "")}:{format};'.encode())
+    h.update(source)
+
+    _update(h, args)
+    _update(h, kwargs)
+
+    return h.hexdigest()
+
+
+def render(func: Callable,
+           args: tuple,
+           kwargs: dict,
+           remote: str,
+           format: str) -> Tuple[Optional[bytes], Optional[str], float]:
+    """
+    Call a plotting function and render the figure it returns, in a worker process
+
+    Parameters
+    ----------
+    func: Callable
+        Plotting function, returning a figure with a savefig method or bytes-like data
+    args: tuple
+        Positional arguments of the call
+    kwargs: dict
+        Keyword arguments of the call
+    remote: str
+        Path of the figure on the remote
+    format: str
+        Format the figure is rendered in
+
+    Returns
+    -------
+    Tuple[Optional[bytes], Optional[str], float]
+        Rendered bytes (None on error), error message, and seconds spent
+    """
+
+    start = time.perf_counter()
+    try:
+        figure = func(*args, **kwargs)
+        data = MemorySource(figure, remote, format).buffer.tobytes()
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}', time.perf_counter() - start
+
+    # NOTE: pyplot keeps every figure alive until it is closed, which would grow long-lived workers without bound
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    if pyplot is not None and hasattr(figure, 'savefig'):
+        pyplot.close(figure)
+
+    return data, None, time.perf_counter() - start
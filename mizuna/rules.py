@@ -0,0 +1,268 @@
+import os
+import posixpath
+import re
+import time
+from typing import Dict, Optional, Pattern, Union
+from .cache import RACY_WINDOW_NS
+from .utils.utils import verbose_print
+
+GLOB_MAGIC = re.compile(r'[*?\[]')
+
+# NOTE: re.Pattern only exists from Python 3.7
+RegexPattern = type(GLOB_MAGIC)
+
+
+def is_pattern(path: str) -> bool:
+    """
+    Checks if a tracked path is a glob pattern rather than the path of a file
+
+    Parameters
+    ----------
+    path: str
+        Tracked path
+
+    Returns
+    -------
+    bool
+        True if the path has glob wildcards (*, ?, [...]) and no file has this exact name
+    """
+    return GLOB_MAGIC.search(path) is not None and not os.path.isfile(path)
+
+
+def glob_to_regex(pattern: str) -> Pattern:
+    """
+    Translate a glob pattern into a regular expression matching paths with forward slashes
+
+    '**' matches any number of directories, '*' and '?' match within one path segment, and '[...]' matches one
+    character of a set.
+
+    Parameters
+    ----------
+    pattern: str
+        Glob pattern
+
+    Returns
+    -------
+    Pattern
+        Compiled regular expression
+    """
+
+    regex = ''
+    segments = pattern.split('/')
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            regex += '.*' if last else '(?:[^/]+/)*'
+            continue
+
+        j = 0
+        while j < len(segment):
+            c = segment[j]
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[' and segment.find(']', j + 1) != -1:
+                end = segment.find(']', j + 1)
+                chars = segment[j + 1:end].replace('\\', '\\\\')
+                regex += '[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']'
+                j = end
+            else:
+                regex += re.escape(c)
+            j += 1
+        if not last:
+            regex += '/'
+
+    return re.compile(regex + r'\Z')
+
+
+def regex_prefix(pattern: str) -> str:
+    """
+    Literal prefix of a regular expression, which every path it matches starts with
+
+    Parameters
+    ----------
+    pattern: str
+        Regular expression
+
+    Returns
+    -------
+    str
+        Characters before the first special character, with escapes resolved
+    """
+
+    # NOTE: an alternative may start anywhere
+    if '|' in pattern.replace('\\|', ''):
+        return ''
+
+    prefix = ''
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            prefix += pattern[i + 1]
+            i += 2
+            continue
+        if c in '\\.^$*+?{}[]|()':
+            break
+        prefix += c
+        i += 1
+
+    # NOTE: a quantifier applies to the last literal character, which is then not part of every match
+    if i < len(pattern) and pattern[i] in '*?{':
+        prefix = prefix[:-1]
+
+    return prefix
+
+
+class TrackingRule:
+
+    def __init__(self,
+                 pattern: Union[str, Pattern],
+                 template: Optional[str] = None):
+        """
+        TrackingRule constructor.
+
+        Tracks every file matching a glob pattern or regular expression, expanded when syncing. Directories are
+        listed with os.scandir and their listings cached by modification time, so rescanning a large tree that did not
+        change only stats its directories.
+
+        Parameters
+        ----------
+        pattern: str or Pattern
+            Glob pattern (e.g., 'results/**/*.pdf') or compiled regular expression matching paths with forward
+            slashes, relative to the working directory; only the directories after the literal prefix of the pattern
+            are scanned
+        template: str, optional
+            Remote path of each file, formatted with {path}, {relpath} (relative to the directories of the pattern
+            without wildcards), {name}, {stem}, {ext} and the named groups of a regular expression; defaults to the
+            path of the file
+        """
+
+        self.pattern = pattern
+        self.template = template
+        self.__listings = dict()
+        self.__matched = None
+
+        if isinstance(pattern, str):
+            pattern = pattern.replace(os.sep, '/')
+            segments = pattern.split('/')
+            fixed = []
+            for segment in segments[:-1]:
+                if GLOB_MAGIC.search(segment):
+                    break
+                fixed.append(segment)
+            self.__root = '/'.join(fixed)
+            self.__regex = glob_to_regex(pattern)
+            wildcards = segments[len(fixed):]
+            self.__max_depth = None if '**' in wildcards else len(wildcards) - 1
+        else:
+            self.__root = posixpath.dirname(regex_prefix(pattern.pattern))
+            self.__regex = pattern
+            self.__max_depth = None
+
+    def __repr__(self):
+        pattern = self.pattern if isinstance(self.pattern, str) else self.pattern.pattern
+        return f'{pattern} -> {self.template}' if self.template is not None else pattern
+
+    def __listing(self,
+                  directory: str) -> tuple:
+
+        try:
+            st = os.stat(directory or '.')
+        except OSError:
+            self.__listings.pop(directory, None)
+            return [], []
+
+        cached = self.__listings.get(directory)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1], cached[2]
+
+        files, directories = [], []
+        with os.scandir(directory or '.') as entries:
+            for entry in entries:
+                path = posixpath.join(directory, entry.name)
+                if entry.is_dir():
+                    if entry.name != '.mizuna':
+                        directories.append(path)
+                elif entry.is_file():
+                    files.append(path)
+
+        # NOTE: entries added within the timestamp resolution of the last change may not bump the mtime again
+        if time.time() * 10 ** 9 - st.st_mtime_ns >= RACY_WINDOW_NS:
+            self.__listings[directory] = (st.st_mtime_ns, files, directories)
+
+        return files, directories
+
+    def matches(self,
+                path: str) -> bool:
+        """
+        Checks if a file matches the rule
+
+        Parameters
+        ----------
+        path: str
+            Path of the file
+
+        Returns
+        -------
+        bool
+            True if the pattern matches the path
+        """
+        return self.__regex.match(path.replace(os.sep, '/')) is not None
+
+    def remote(self,
+               path: str,
+               match) -> str:
+        """
+        Remote path of a matching file
+
+        Parameters
+        ----------
+        path: str
+            Path of the file, with forward slashes
+        match: re.Match
+            Match of the pattern on the path
+
+        Returns
+        -------
+        str
+            Remote path
+        """
+
+        if self.template is None:
+            return path
+
+        name = posixpath.basename(path)
+        stem, ext = posixpath.splitext(name)
+        relpath = posixpath.relpath(path, self.__root) if self.__root else path
+
+        return self.template.format(path=path, relpath=relpath, name=name, stem=stem, ext=ext, **match.groupdict())
+
+    def expand(self) -> Dict[str, str]:
+        """
+        Find the files matching the rule
+
+        Returns
+        -------
+        Dict[str, str]
+            Dictionary where { file_path: remote_path }
+        """
+
+        matches = dict()
+        pending = [(self.__root, 0)]
+        while pending:
+            directory, depth = pending.pop()
+            files, directories = self.__listing(directory)
+            for path in files:
+                match = self.__regex.match(path)
+                if match is not None:
+                    matches[path] = self.remote(path, match)
+            if self.__max_depth is None or depth < self.__max_depth:
+                pending += [(d, depth + 1) for d in directories]
+
+        if len(matches) != self.__matched:
+            verbose_print(f'[mizuna] {self} matched {len(matches)} files.')
+            self.__matched = len(matches)
+
+        return matches
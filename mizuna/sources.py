@@ -0,0 +1,132 @@
+import io
+import os
+from typing import Any, Optional
+from .utils.utils import blob_hash_bytes
+
+
+def is_memory_source(data: Any) -> bool:
+    """
+    Checks if an object can be tracked as in-memory data rather than a file path
+
+    Parameters
+    ----------
+    data: Any
+        Object to check
+
+    Returns
+    -------
+    bool
+        True for bytes, bytearray, memoryview, io.BytesIO and figures with a savefig method (e.g., matplotlib)
+    """
+    return isinstance(data, (bytes, bytearray, memoryview, io.BytesIO, MemorySource)) or hasattr(data, 'savefig')
+
+
+class MemorySource:
+
+    def __init__(self,
+                 data: Any,
+                 remote: str,
+                 format: Optional[str] = None,
+                 blob: Optional[str] = None,
+                 origin: Optional[Any] = None):
+        """
+        MemorySource constructor.
+
+        In-memory content of a tracked file. Byte buffers are referenced without copying; BytesIO objects are read and
+        figures are rendered when tracked, in the format given by the extension of the remote path. Content stored
+        elsewhere (e.g., a cached output) can be given as a function, called only if the content is needed.
+
+        Parameters
+        ----------
+        data: Any
+            bytes, bytearray, memoryview, io.BytesIO, a figure with a savefig method (e.g., matplotlib Figure), or a
+            function returning bytes (blob is then required)
+        remote: str
+            Path of the file on the remote
+        format: str, optional
+            Format figures are rendered in, defaults to the extension of the remote path
+        blob: str, optional
+            SHA-1 git blob ID of the content, if already known
+        origin: Any, optional
+            Tracked file the content was transformed from, shown in messages instead of the content
+
+        Raises
+        ------
+        Exception
+            If the data type is not supported
+        """
+
+        self.__data = data
+        self.__blob = blob
+        self.__origin = origin
+        format = format or os.path.splitext(remote)[1][1:].lower() or 'png'
+
+        if callable(data) and not hasattr(data, 'savefig'):
+            if blob is None:
+                raise Exception('The blob ID of content loaded on demand must be known.')
+            self.__buffer = None
+        elif isinstance(data, (bytes, bytearray)):
+            self.__buffer = memoryview(data)
+        elif isinstance(data, memoryview):
+            self.__buffer = data.cast('B') if data.format != 'B' or data.ndim != 1 else data
+        elif isinstance(data, io.BytesIO):
+            self.__buffer = memoryview(data.getvalue())
+        elif hasattr(data, 'savefig'):
+            rendered = io.BytesIO()
+            data.savefig(rendered, format=format)
+            self.__buffer = memoryview(rendered.getvalue())
+        else:
+            raise Exception(f'Cannot track in-memory data of type {type(data).__name__}.')
+
+    def __repr__(self):
+        if self.__origin is not None:
+            return f'{self.__origin} (transformed)'
+        if self.__buffer is None:
+            return f'<in-memory blob {self.__blob}: not loaded>'
+        return f'<in-memory {type(self.__data).__name__}: {self.__buffer.nbytes} bytes>'
+
+    @property
+    def data(self):
+        """
+        Returns the object passed when tracking
+
+        Returns
+        -------
+        Any
+            Tracked object
+        """
+        return self.__data
+
+    @property
+    def buffer(self) -> memoryview:
+        """
+        Returns the content to sync
+
+        Returns
+        -------
+        memoryview
+            Byte view of the content
+        """
+        if self.__buffer is None:
+            self.__buffer = memoryview(self.__data())
+        return self.__buffer
+
+    def blob_hash(self,
+                  algorithm: str = 'sha1') -> str:
+        """
+        Computes the git blob ID of the content
+
+        Parameters
+        ----------
+        algorithm: str, optional
+            Object format of the repository ('sha1' or 'sha256')
+
+        Returns
+        -------
+        str
+            Hexadecimal blob object ID
+        """
+        if algorithm == 'sha1' and self.__blob is not None:
+            return self.__blob
+
+        return blob_hash_bytes(self.buffer, algorithm)
@@ -0,0 +1,228 @@
+from .sources import MemorySource, is_memory_source
+from .rules import TrackingRule, RegexPattern, is_pattern, glob_to_regex
+from .utils.utils import all_of_type
+
+
+class Tracker:
+
+    def __init__(self):
+        """
+        Tracker constructor.
+
+        Registry of tracked files, where { file_path: remote_path }, and of tracking rules expanded when syncing.
+        """
+
+        self.__files_tracked = dict()
+        self.__rules = dict()
+
+    @property
+    def track_list(self):
+        """
+        Returns the list of files tracked
+
+        Returns
+        -------
+        list
+            List of files tracked
+        """
+        return self.__files_tracked
+
+    @property
+    def rules(self):
+        """
+        Returns the tracking rules
+
+        Returns
+        -------
+        list
+            List of TrackingRule
+        """
+        return list(self.__rules.values())
+
+    def expand(self) -> dict:
+        """
+        Expands the tracking rules into the files they currently match, along with the files tracked explicitly
+
+        Returns
+        -------
+        dict
+            Dictionary where { file_path: remote_path }; explicitly tracked files take precedence over rules
+        """
+
+        files = dict()
+        for rule in self.__rules.values():
+            files.update(rule.expand())
+        files.update(self.__files_tracked)
+
+        return files
+
+    @property
+    def track_count(self):
+        """
+        Returns the number of files tracked
+
+        Returns
+        -------
+        int
+            Number of files tracked
+        """
+        return len(self.__files_tracked)
+
+    def track(self,
+              *args):
+
+        """
+        Tracks a single or set of files, with optional renaming on the remote
+
+        Parameters
+        ----------
+        args
+            - The path of a single file
+            - The path of a single file, the path of its rename on the remote
+            - A list of file paths
+            - A list of tuple containing file paths and rename paths
+            - A dictionary where { file_path: remote_path }
+            - In-memory data (bytes, bytearray, memoryview, io.BytesIO, or a matplotlib Figure rendered in the format
+              of the remote path extension), the path of the file on the remote
+            - A glob pattern (e.g., 'results/**/*.pdf') or compiled regular expression, and optionally a remote path
+              template (e.g., 'figures/{relpath}'), stored as a rule and expanded when syncing (see TrackingRule)
+
+        Returns
+        -------
+        list
+            List of tuples (file, remote_path) of the entries tracked by this call, excluding rules
+
+        Raises
+        ------
+        Exception
+            If arguments not enough, too many, or invalid
+        """
+
+        if len(args) == 0:
+            raise Exception('Not enough arguments.')
+        if len(args) > 2:
+            raise Exception('Too many arguments.')
+
+        files = args[0]
+        rename = args[1] if len(args) == 2 else None
+        tracked = []
+
+        # single file
+        if isinstance(files, str) and rename is None:
+            tracked.append(self.__track_single(files))
+
+        # single file with rename
+        elif isinstance(files, str) and rename is not None:
+            tracked.append(self.__track_single(files, rename))
+
+        # regular expression rule
+        elif isinstance(files, RegexPattern):
+            tracked.append(self.__track_single(files, rename or ''))
+
+        # in-memory data with remote path
+        elif is_memory_source(files) and rename is not None:
+            tracked.append(self.__track_single(files, rename))
+
+        # list of files or tuples
+        elif isinstance(files, list) and rename is None:
+            if all_of_type(files, str):
+                for f in files:
+                    tracked.append(self.__track_single(f))
+            elif all_of_type(files, tuple):
+                for f in files:
+                    tracked.append(self.__track_single(f[0], f[1]))
+            else:
+                raise Exception('Invalid type passed in list.')
+
+        # dictionary
+        elif isinstance(files, dict) and rename is None:
+            tracked.extend(self.__track_multiple_dict(files))
+
+        # invalid type
+        else:
+            raise Exception('Invalid arguments passed.')
+
+        return [t for t in tracked if t is not None]
+
+    def __track_single(self,
+                       file: str,
+                       remote: str = '') -> tuple:
+
+        if not isinstance(remote, str):
+            raise Exception('Remote is not a string.') # TODO: better error message
+
+        if isinstance(file, RegexPattern) or isinstance(file, str) and is_pattern(file):
+            self.__rules[file] = TrackingRule(file, remote or None)
+            return None
+
+        if not isinstance(file, str):
+            if remote == '':
+                raise Exception('A remote path is required to track in-memory data.')
+            self.__untrack_memory(remote)
+            file = file if isinstance(file, MemorySource) else MemorySource(file, remote)
+
+        if remote == '':
+            self.__files_tracked.update({file: file})
+        else:
+            self.__files_tracked.update({file: remote})
+
+        return file, self.__files_tracked[file]
+
+    def __track_multiple_dict(self,
+                              files: dict) -> list:
+
+        return [self.__track_single(f, r) for f, r in files.items()]
+
+    def __untrack_memory(self,
+                         match) -> bool:
+
+        keys = [k for k, r in self.__files_tracked.items()
+                if isinstance(k, MemorySource) and (k.data is match or r == match)]
+        for k in keys:
+            self.__files_tracked.pop(k)
+
+        return len(keys) > 0
+
+    def untrack(self, file):
+        """
+        Untracks a single file
+
+        Parameters
+        ----------
+        file
+            The file to untrack, tracked in-memory data (or its remote path), or a glob pattern or regular expression,
+            which removes the rule tracking it and the tracked files it matches
+
+        Raises
+        ------
+        KeyError
+            If the file is not found
+        """
+
+        if isinstance(file, str) and file in self.__files_tracked:
+            self.__files_tracked.pop(file)
+        elif isinstance(file, RegexPattern) or isinstance(file, str) and is_pattern(file):
+            if not self.__untrack_pattern(file):
+                raise KeyError(file)
+        elif not self.__untrack_memory(file):
+            raise KeyError(file)
+        print(f"[mizuna] {file if isinstance(file, str) else 'In-memory data'} untracked.")
+
+    def __untrack_pattern(self,
+                          pattern) -> bool:
+
+        regex = glob_to_regex(pattern.replace('\\', '/')) if isinstance(pattern, str) else pattern
+        keys = [k for k in self.__files_tracked if isinstance(k, str) and regex.match(k.replace('\\', '/'))]
+        for k in keys:
+            self.__files_tracked.pop(k)
+
+        return self.__rules.pop(pattern, None) is not None or len(keys) > 0
+
+    def untrack_all(self):
+        """
+        Untracks all the files and rules
+        """
+
+        self.__files_tracked.clear()
+        self.__rules.clear()
+        print(f'[mizuna] All files untracked.')
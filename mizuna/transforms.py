@@ -0,0 +1,639 @@
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import posixpath
+import re
+import string
+import struct
+import zlib
+from typing import List, Optional, Sequence
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+from .utils.utils import normalize_remote_path
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is installed with matplotlib
+    Image = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# NOTE: the date that replaces creation and modification dates, truncated to the length of the date it replaces
+CANONICAL_PDF_DATE = b'D:19700101000000Z'
+
+PDF_DATE = re.compile(rb'(/(?:CreationDate|ModDate)\s*)\((D:[^)]*)\)')
+PDF_ID = re.compile(rb'(/ID\s*\[\s*)<([0-9A-Fa-f]*)>(\s*)<([0-9A-Fa-f]*)>')
+
+# timestamp and textual metadata chunks (software version, creation time, ...)
+VOLATILE_PNG_CHUNKS = {b'tIME', b'tEXt', b'zTXt', b'iTXt'}
+
+# ancillary chunks that change how an image is displayed (transparency, colour space, physical size), kept when
+# ancillary chunks are dropped
+RENDERING_PNG_CHUNKS = ('tRNS', 'gAMA', 'cHRM', 'sRGB', 'iCCP', 'pHYs')
+
+SVG_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+SVG_REFERENCE = re.compile(r'url\(\s*#([^)\s]+)\s*\)')
+CSS_BLOCK = re.compile(r'([{}])')
+CSS_ID_SELECTOR = re.compile(r'#(-?[_A-Za-z][-\w]*)')
+
+# attributes holding coordinates and lengths, whose numbers are rounded (not transform, whose scale factors may be tiny)
+SVG_GEOMETRY_ATTRIBUTES = {'d', 'points', 'viewBox', 'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry',
+                           'width', 'height', 'dx', 'dy'}
+
+# elements whose text is content, where whitespace is significant
+SVG_TEXT_ELEMENTS = {'text', 'tspan', 'textPath', 'title', 'desc', 'style', 'script'}
+
+SVG_METADATA_ELEMENTS = {'metadata'}
+
+SVG_FEED_SIZE = 1 << 20
+
+
+def png_chunks(data: bytes):
+    """
+    Iterate over the chunks of a PNG image
+
+    Parameters
+    ----------
+    data: bytes
+        Content of the image
+
+    Returns
+    -------
+    Iterator[Tuple[bytes, memoryview, memoryview]]
+        (chunk type, chunk data, whole chunk including its length, type and CRC) for each chunk
+
+    Raises
+    ------
+    ValueError
+        If the data is not a well-formed PNG image
+    """
+
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError('Not a PNG image.')
+
+    view = memoryview(data)
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        if offset + 12 > len(data):
+            raise ValueError('Truncated PNG chunk.')
+        length, kind = struct.unpack_from('>I4s', data, offset)
+        end = offset + 12 + length
+        if end > len(data):
+            raise ValueError('Truncated PNG chunk.')
+        yield kind, view[offset + 8:offset + 8 + length], view[offset:end]
+        offset = end
+        if kind == b'IEND':
+            break
+
+
+def png_chunk(kind: bytes,
+              data: bytes) -> bytes:
+    """
+    Serialize a PNG chunk
+
+    Parameters
+    ----------
+    kind: bytes
+        Four-letter chunk type
+    data: bytes
+        Chunk data
+
+    Returns
+    -------
+    bytes
+        Chunk with its length, type and CRC
+    """
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+class Transform:
+    """
+    Base class of the transforms applied to tracked files before they are hashed and committed
+
+    Subclasses set a unique name and the extensions of the remote paths they apply to, and implement __call__.
+    """
+
+    name = 'transform'
+
+    # lowercase extensions, including the dot, of the remote paths transformed; None for every path
+    extensions: Optional[Sequence[str]] = None
+
+    def __init__(self,
+                 patterns: Optional[Sequence[str]] = None):
+        """
+        Transform constructor.
+
+        Parameters
+        ----------
+        patterns: Sequence[str], optional
+            Only transform files whose remote path matches one of these fnmatch patterns, e.g., 'appendix/*.png'
+        """
+        self.patterns = list(patterns) if patterns is not None else None
+
+    @property
+    def config(self) -> dict:
+        """
+        Returns the options of the transform, so that outputs are only reused with the same options
+
+        Returns
+        -------
+        dict
+            JSON-serializable options
+        """
+        return dict()
+
+    def applies(self,
+                remote: str) -> bool:
+        """
+        Checks if the transform applies to a file
+
+        Parameters
+        ----------
+        remote: str
+            Path of the file on the remote
+
+        Returns
+        -------
+        bool
+            True if the file is transformed
+        """
+        if self.extensions is not None and posixpath.splitext(remote)[1].lower() not in self.extensions:
+            return False
+
+        return self.patterns is None or any(fnmatch.fnmatchcase(normalize_remote_path(remote), p)
+                                            for p in self.patterns)
+
+    def __call__(self,
+                 data: bytes,
+                 remote: str) -> bytes:
+        """
+        Transform the content of a file
+
+        Parameters
+        ----------
+        data: bytes
+            Content of the file
+        remote: str
+            Path of the file on the remote
+
+        Returns
+        -------
+        bytes
+            Transformed content
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.config})'
+
+
+def stage_key(input_blob: str,
+              transform: Transform) -> str:
+    """
+    Key of the output of a transform applied to an input, for ContentCache
+
+    Parameters
+    ----------
+    input_blob: str
+        SHA-1 blob ID of the input
+    transform: Transform
+        Transform applied
+
+    Returns
+    -------
+    str
+        Hexadecimal key, derived from the input, the name of the transform and its options
+    """
+    return hashlib.sha1(json.dumps([input_blob, transform.name, transform.config], sort_keys=True).encode()).hexdigest()
+
+
+def apply_chain(chain: Sequence[Transform],
+                data: bytes,
+                remote: str) -> List[bytes]:
+    """
+    Apply transforms in order, in a worker thread or process
+
+    Parameters
+    ----------
+    chain: Sequence[Transform]
+        Transforms to apply
+    data: bytes
+        Content of the file
+    remote: str
+        Path of the file on the remote
+
+    Returns
+    -------
+    List[bytes]
+        Output of each transform
+    """
+
+    outputs = []
+    for transform in chain:
+        data = transform(data, remote)
+        outputs.append(data)
+
+    return outputs
+
+
+class NormalizeMetadata(Transform):
+    """
+    Canonicalizes volatile metadata so that re-rendered, content-equal figures produce identical files
+
+    PDF creation and modification dates and the document ID are replaced in place (keeping their length, so the
+    cross-reference table stays valid); PNG timestamp and text chunks are dropped. Files that are not PDF or PNG
+    documents, or that cannot be parsed, are left unchanged.
+    """
+
+    name = 'normalize_metadata'
+    extensions = ('.pdf', '.png')
+
+    def __call__(self,
+                 data: bytes,
+                 remote: str) -> bytes:
+
+        if data.startswith(b'%PDF-'):
+            return self.pdf(data)
+        if data.startswith(PNG_SIGNATURE):
+            return self.png(data)
+
+        return data
+
+    @staticmethod
+    def pdf(data: bytes) -> bytes:
+        """
+        Canonicalize the creation and modification dates and the ID of a PDF document
+
+        Parameters
+        ----------
+        data: bytes
+            Content of the document
+
+        Returns
+        -------
+        bytes
+            Content of the document with canonical metadata, of the same length
+        """
+
+        def date(match):
+            original = match.group(2)
+            canonical = CANONICAL_PDF_DATE[:len(original)]
+            return match.group(1) + b'(' + canonical + b')' + b' ' * (len(original) - len(canonical))
+
+        def document_id(match):
+            return match.group(1) + b'<' + b'0' * len(match.group(2)) + b'>' + match.group(3) + \
+                   b'<' + b'0' * len(match.group(4)) + b'>'
+
+        return PDF_ID.sub(document_id, PDF_DATE.sub(date, data))
+
+    @staticmethod
+    def png(data: bytes) -> bytes:
+        """
+        Drop the timestamp and text chunks of a PNG image
+
+        Parameters
+        ----------
+        data: bytes
+            Content of the image
+
+        Returns
+        -------
+        bytes
+            Content of the image without volatile chunks, or the original content if it is malformed
+        """
+
+        try:
+            chunks = [chunk for kind, _, chunk in png_chunks(data) if kind not in VOLATILE_PNG_CHUNKS]
+        except ValueError:
+            return data
+
+        return PNG_SIGNATURE + b''.join(chunks)
+
+
+class RecompressPNG(Transform):
+
+    name = 'recompress_png'
+    extensions = ('.png',)
+
+    def __init__(self,
+                 level: int = 9,
+                 keep: Sequence[str] = RENDERING_PNG_CHUNKS,
+                 patterns: Optional[Sequence[str]] = None):
+        """
+        RecompressPNG constructor.
+
+        Losslessly shrinks PNG images: the image data is re-deflated at the given level (keeping the smallest of the
+        default and filtered strategies) and ancillary chunks that do not change how the image is displayed are
+        dropped. Images that would not get smaller, or cannot be parsed, are left unchanged.
+
+        Parameters
+        ----------
+        level: int, optional
+            zlib compression level
+        keep: Sequence[str], optional
+            Ancillary chunk types to keep
+        patterns: Sequence[str], optional
+            See Transform
+        """
+
+        super().__init__(patterns)
+        self.level = level
+        self.keep = {k.encode() for k in keep}
+
+    @property
+    def config(self) -> dict:
+        return {'level': self.level, 'keep': sorted(k.decode() for k in self.keep)}
+
+    def __deflate(self,
+                  raw: bytes,
+                  strategy: int) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 15, 9, strategy)
+        return compressor.compress(raw) + compressor.flush()
+
+    def __call__(self,
+                 data: bytes,
+                 remote: str) -> bytes:
+
+        try:
+            chunks = list(png_chunks(data))
+            raw = zlib.decompress(b''.join(body for kind, body, _ in chunks if kind == b'IDAT'))
+        except (ValueError, zlib.error):
+            return data
+
+        deflated = min((self.__deflate(raw, s) for s in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)), key=len)
+
+        recompressed = [PNG_SIGNATURE]
+        for kind, _, chunk in chunks:
+            if kind == b'IDAT':
+                if deflated is not None:
+                    recompressed.append(png_chunk(b'IDAT', deflated))
+                    deflated = None
+            elif kind[:1].isupper() or kind in self.keep:
+                recompressed.append(chunk)
+        recompressed = b''.join(recompressed)
+
+        return recompressed if len(recompressed) < len(data) else data
+
+
+class CapResolution(Transform):
+
+    name = 'cap_resolution'
+    extensions = ('.png',)
+
+    def __init__(self,
+                 max_size: Optional[int] = None,
+                 max_dpi: Optional[float] = None,
+                 patterns: Optional[Sequence[str]] = None):
+        """
+        CapResolution constructor.
+
+        Downsamples PNG images larger than a number of pixels or denser than a resolution. The resolution recorded in
+        the image is scaled with it, so the image keeps its physical size when included in a document.
+
+        Parameters
+        ----------
+        max_size: int, optional
+            Maximum number of pixels on the longest side
+        max_dpi: float, optional
+            Maximum resolution, for images that record one
+        patterns: Sequence[str], optional
+            See Transform
+
+        Raises
+        ------
+        ImportError
+            If Pillow is not installed
+        """
+
+        if Image is None:
+            raise ImportError('Capping the resolution of images requires Pillow.')
+
+        super().__init__(patterns)
+        self.max_size = max_size
+        self.max_dpi = max_dpi
+
+    @property
+    def config(self) -> dict:
+        return {'max_size': self.max_size, 'max_dpi': self.max_dpi}
+
+    def __call__(self,
+                 data: bytes,
+                 remote: str) -> bytes:
+
+        with Image.open(io.BytesIO(data)) as image:
+            dpi = image.info.get('dpi')
+
+            scale = 1.0
+            if self.max_size is not None and max(image.size) > self.max_size:
+                scale = self.max_size / max(image.size)
+            if self.max_dpi is not None and dpi and max(dpi) > self.max_dpi:
+                scale = min(scale, self.max_dpi / max(dpi))
+            if scale >= 1.0:
+                return data
+
+            size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+            resized = image.resize(size, Image.LANCZOS)
+
+        options = {'dpi': (dpi[0] * scale, dpi[1] * scale)} if dpi else dict()
+        capped = io.BytesIO()
+        resized.save(capped, format='PNG', optimize=True, **options)
+
+        return capped.getvalue()
+
+
+class MinifySVG(Transform):
+
+    name = 'minify_svg'
+    extensions = ('.svg', '.svgz')
+
+    def __init__(self,
+                 precision: int = 3,
+                 compress: bool = False,
+                 patterns: Optional[Sequence[str]] = None):
+        """
+        MinifySVG constructor.
+
+        Shrinks SVG documents in one streaming pass, without building a DOM: metadata, comments and the document type
+        are stripped, ids (and the references to them) are shortened, coordinates are rounded, and whitespace between
+        elements is removed. Gzipped documents (.svgz) are decompressed first and compressed again.
+
+        Parameters
+        ----------
+        precision: int, optional
+            Number of decimals coordinates and lengths are rounded to
+        compress: bool, optional
+            Gzip the output even if the input was not gzipped (outputs for remote paths ending in .svgz always are)
+        patterns: Sequence[str], optional
+            See Transform
+        """
+
+        super().__init__(patterns)
+        self.precision = precision
+        self.compress = compress
+
+    @property
+    def config(self) -> dict:
+        return {'precision': self.precision, 'compress': self.compress}
+
+    def __call__(self,
+                 data: bytes,
+                 remote: str) -> bytes:
+
+        gzipped = data[:2] == b'\x1f\x8b'
+        if gzipped:
+            data = gzip.decompress(data)
+
+        minified = _SVGMinifier(self.precision).minify(data)
+        if not (self.compress or gzipped or remote.lower().endswith('.svgz')):
+            return minified
+
+        # NOTE: mtime=0 so the same document always compresses to the same bytes (gzip.compress only takes it from 3.8)
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=9, mtime=0) as f:
+            f.write(minified)
+
+        return compressed.getvalue()
+
+
+class _SVGMinifier:
+
+    def __init__(self,
+                 precision: int):
+
+        self.__precision = precision
+        self.__ids = dict()
+        self.__out = []
+        self.__pending = False
+        self.__skip = 0
+        self.__text = []
+        self.__stack = []
+
+        self.__parser = expat.ParserCreate()
+        self.__parser.buffer_text = True
+        self.__parser.ordered_attributes = True
+        self.__parser.StartElementHandler = self.__start
+        self.__parser.EndElementHandler = self.__end
+        self.__parser.CharacterDataHandler = self.__characters
+
+    def minify(self,
+               data: bytes) -> bytes:
+
+        self.__out.append('<?xml version="1.0" encoding="utf-8"?>')
+        view = memoryview(data)
+        for offset in range(0, len(data), SVG_FEED_SIZE):
+            self.__parser.Parse(bytes(view[offset:offset + SVG_FEED_SIZE]), False)
+        self.__parser.Parse(b'', True)
+
+        return ''.join(self.__out).encode()
+
+    def __short_id(self,
+                   original: str) -> str:
+
+        if original not in self.__ids:
+            n = len(self.__ids)
+            digits = string.ascii_letters + string.digits
+            short = string.ascii_letters[n % 52]
+            n //= 52
+            while n:
+                short += digits[n % 62]
+                n //= 62
+            self.__ids[original] = short
+
+        return self.__ids[original]
+
+    def __number(self,
+                 match) -> str:
+
+        number = f'{round(float(match.group(0)), self.__precision):.{self.__precision}f}'
+        if '.' in number:
+            number = number.rstrip('0').rstrip('.')
+        if number in ('-0', '+0', ''):
+            return '0'
+
+        return number.replace('0.', '.', 1) if number.startswith(('0.', '-0.')) else number
+
+    def __attribute(self,
+                    name: str,
+                    value: str) -> str:
+
+        if name == 'id':
+            return self.__short_id(value)
+        if name in ('href', 'xlink:href') and value.startswith('#'):
+            return '#' + self.__short_id(value[1:])
+
+        value = SVG_REFERENCE.sub(lambda m: f'url(#{self.__short_id(m.group(1))})', value)
+        if name in SVG_GEOMETRY_ATTRIBUTES:
+            value = SVG_NUMBER.sub(self.__number, ' '.join(value.split()))
+            if name == 'd':
+                value = re.sub(r'\s*([A-DF-Za-df-z])\s*', r'\1', value)
+
+        return value
+
+    def __close_pending(self):
+
+        if self.__pending:
+            self.__out.append('>')
+            self.__pending = False
+
+    def __flush_text(self,
+                     tag: str = None):
+
+        text = ''.join(self.__text)
+        self.__text = []
+        if not text or (not text.strip() and tag not in SVG_TEXT_ELEMENTS):
+            return
+
+        self.__close_pending()
+        if tag == 'style':
+            text = self.__style(' '.join(text.split()))
+        self.__out.append(escape(text))
+
+    def __style(self,
+                css: str) -> str:
+
+        # NOTE: '#id' selectors are only rewritten in the text before a '{', since '#...' in declarations are colors
+        parts = CSS_BLOCK.split(css)
+        for i in range(0, len(parts) - 1, 2):
+            if parts[i + 1] == '{':
+                parts[i] = CSS_ID_SELECTOR.sub(lambda m: '#' + self.__short_id(m.group(1)), parts[i])
+
+        return SVG_REFERENCE.sub(lambda m: f'url(#{self.__short_id(m.group(1))})', ''.join(parts))
+
+    def __start(self,
+                tag: str,
+                attributes: list):
+
+        if self.__skip or tag in SVG_METADATA_ELEMENTS:
+            self.__skip += 1
+            return
+
+        self.__flush_text(self.__stack[-1] if self.__stack else None)
+        self.__close_pending()
+
+        pairs = zip(attributes[0::2], attributes[1::2])
+        self.__out.append('<' + tag + ''.join(f' {k}={quoteattr(self.__attribute(k, v))}' for k, v in pairs))
+        self.__pending = True
+        self.__stack.append(tag)
+
+    def __end(self,
+              tag: str):
+
+        if self.__skip:
+            self.__skip -= 1
+            return
+
+        self.__flush_text(tag)
+        self.__stack.pop()
+        if self.__pending:
+            self.__out.append('/>')
+            self.__pending = False
+        else:
+            self.__out.append(f'</{tag}>')
+
+    def __characters(self,
+                     data: str):
+
+        if not self.__skip:
+            self.__text.append(data)
@@ -1,4 +1,6 @@
 from typing import List, Optional, Dict, Tuple, Any
+import hashlib
+import os
 import subprocess
 import warnings
 
@@ -9,7 +11,8 @@ def call_subprocess(cmd_tokens: List[str],
                     cwd: str,
                     check: bool = True,
                     shell: bool = False,
-                    env: Optional[Dict[str, str]] = None) -> Tuple[int, Any, Any]:
+                    env: Optional[Dict[str, str]] = None,
+                    input: Optional[bytes] = None) -> Tuple[int, Any, Any]:
     """
     Executes a subprocess call.
 
@@ -25,6 +28,8 @@ def call_subprocess(cmd_tokens: List[str],
         Run as shell command (not recommended)
     env: dict, optional
         Environment variables to pass to the subprocess
+    input: bytes, optional
+        Data sent to the standard input of the subprocess
 
     Returns
     -------
@@ -39,7 +44,7 @@ def call_subprocess(cmd_tokens: List[str],
 
     try:
         r = subprocess.run(cmd_tokens, cwd=cwd, stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                           check=check, shell=shell, env=env)
+                           check=check, shell=shell, env=env, input=input)
         return r.returncode, r.stdout, r.stderr
     except subprocess.CalledProcessError as err:
         warnings.warn(f"An error occurred in a subprocess call:\ncmd: {' '.join(cmd_tokens)}\n"
@@ -78,3 +83,77 @@ def all_of_type(elements, type_check):
         raise Exception('List empty.')
 
     return all([isinstance(x, type_check) for x in elements])
+
+
+def git_blob_hash(path: str,
+                  algorithm: str = 'sha1',
+                  chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the git blob object ID of a file without invoking git
+
+    Parameters
+    ----------
+    path: str
+        Path of the file to hash
+    algorithm: str, optional
+        Object format of the repository ('sha1' or 'sha256')
+    chunk_size: int, optional
+        Number of bytes read per chunk
+
+    Returns
+    -------
+    str
+        Hexadecimal blob object ID, identical to `git hash-object <path>`
+    """
+
+    h = hashlib.new(algorithm)
+    h.update(b'blob %d\0' % os.path.getsize(path))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def blob_hash_bytes(data,
+                    algorithm: str = 'sha1') -> str:
+    """
+    Computes the git blob object ID of in-memory content
+
+    Parameters
+    ----------
+    data: bytes-like
+        Content to hash
+    algorithm: str, optional
+        Object format of the repository ('sha1' or 'sha256')
+
+    Returns
+    -------
+    str
+        Hexadecimal blob object ID
+    """
+
+    data = memoryview(data)
+    h = hashlib.new(algorithm)
+    h.update(b'blob %d\0' % data.nbytes)
+    h.update(data)
+
+    return h.hexdigest()
+
+
+def normalize_remote_path(path: str) -> str:
+    """
+    Normalizes a remote path to the form git uses in tree listings
+
+    Parameters
+    ----------
+    path: str
+        Path relative to the root of the repository
+
+    Returns
+    -------
+    str
+        Normalized path with forward slashes, e.g., 'figures/fig1.png'
+    """
+
+    return os.path.normpath(path).replace(os.sep, '/')
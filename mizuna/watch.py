@@ -0,0 +1,266 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Iterable
+from .utils.utils import verbose_print
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class PollBackend:
+
+    def __init__(self):
+        """
+        PollBackend constructor.
+
+        Detects changes by comparing the stat signature (size, mtime_ns, inode) of the watched files.
+        """
+
+        self.__signatures = dict()
+
+    @staticmethod
+    def __signature(path: str):
+        try:
+            st = os.stat(path)
+            return st.st_size, st.st_mtime_ns, st.st_ino
+        except OSError:
+            return None
+
+    def changes(self,
+                paths: set,
+                timeout: float,
+                stop: threading.Event) -> bool:
+        """
+        Wait for a change to the watched files
+
+        Parameters
+        ----------
+        paths: set
+            Absolute paths of the files to watch
+        timeout: float
+            Seconds to wait before checking the files
+        stop: threading.Event
+            Event that interrupts the wait
+
+        Returns
+        -------
+        bool
+            True if a file changed since the last call (new files are recorded, not reported)
+        """
+
+        stop.wait(timeout)
+
+        changed = False
+        for path in paths:
+            sig = self.__signature(path)
+            if path in self.__signatures and self.__signatures[path] != sig:
+                changed = True
+            self.__signatures[path] = sig
+
+        for path in set(self.__signatures) - paths:
+            del self.__signatures[path]
+
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyBackend:
+
+    def __init__(self):
+        """
+        InotifyBackend constructor.
+
+        Detects changes with Linux inotify, watching the directories that contain the watched files.
+
+        Raises
+        ------
+        OSError
+            If inotify is not available
+        """
+
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux.')
+
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+
+        self.__directories = dict()
+
+    def __watch_directories(self,
+                            paths: set):
+
+        for directory in {os.path.dirname(p) for p in paths} - set(self.__directories.values()):
+            wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(directory),
+                                               IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd >= 0:
+                self.__directories[wd] = directory
+
+    def changes(self,
+                paths: set,
+                timeout: float,
+                stop: threading.Event) -> bool:
+        """
+        Wait for a change to the watched files
+
+        Parameters
+        ----------
+        paths: set
+            Absolute paths of the files to watch
+        timeout: float
+            Maximum number of seconds to wait
+        stop: threading.Event
+            Event that interrupts the wait (checked at least every timeout seconds)
+
+        Returns
+        -------
+        bool
+            True if a watched file was written, created or moved into place
+        """
+
+        self.__watch_directories(paths)
+
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return False
+
+        try:
+            buffer = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        changed = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            directory = self.__directories.get(wd)
+            if directory is not None and os.path.join(directory, os.fsdecode(name)) in paths:
+                changed = True
+
+        return changed
+
+    def close(self):
+        os.close(self.__fd)
+
+
+class Watcher:
+
+    def __init__(self,
+                 paths: Callable[[], Iterable[str]],
+                 callback: Callable[[], None],
+                 debounce: float = 1.0,
+                 poll_interval: float = 0.5,
+                 backend: str = 'auto'):
+        """
+        Watcher constructor.
+
+        Calls back once a burst of changes to the watched files has been followed by a quiet window.
+
+        Parameters
+        ----------
+        paths: Callable
+            Function returning the paths of the files to watch, called on every check so the set can change
+        callback: Callable
+            Function called once per quiet window after changes
+        debounce: float
+            Seconds without changes before calling back
+        poll_interval: float
+            Seconds between checks
+        backend: str
+            'inotify', 'poll', or 'auto' to use inotify where available and stat polling otherwise
+        """
+
+        if backend not in ('auto', 'inotify', 'poll'):
+            raise Exception(f'Invalid backend: {backend}')
+
+        self.__paths = paths
+        self.__callback = callback
+        self.__debounce = debounce
+        self.__poll_interval = poll_interval
+
+        self.__backend = None
+        if backend in ('auto', 'inotify'):
+            try:
+                self.__backend = InotifyBackend()
+            except (OSError, AttributeError) as e:
+                if backend == 'inotify':
+                    raise
+                verbose_print(f'[mizuna] inotify unavailable ({e}) -- polling instead.')
+        if self.__backend is None:
+            self.__backend = PollBackend()
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='mizuna-watch', daemon=True)
+
+    @property
+    def backend(self):
+        """
+        Get the name of the change detection backend
+
+        Returns
+        -------
+        str
+            'inotify' or 'poll'
+        """
+        return 'inotify' if isinstance(self.__backend, InotifyBackend) else 'poll'
+
+    @property
+    def running(self):
+        """
+        Whether the watcher thread is running
+
+        Returns
+        -------
+        bool
+            True if running
+        """
+        return self.__thread.is_alive()
+
+    def start(self):
+        """
+        Start watching on a background thread
+        """
+
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop watching and wait for the watcher thread to exit
+        """
+
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def __run(self):
+
+        last_change = None
+        try:
+            while not self.__stop.is_set():
+                paths = {os.path.abspath(p) for p in self.__paths()}
+                if self.__backend.changes(paths, self.__poll_interval, self.__stop):
+                    last_change = time.monotonic()
+
+                if last_change is not None and time.monotonic() - last_change >= self.__debounce:
+                    last_change = None
+                    self.__callback()
+        finally:
+            self.__backend.close()
@@ -0,0 +1,147 @@
+import atexit
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Hashable
+from .utils.utils import verbose_print
+
+_workers = dict()
+_workers_lock = threading.Lock()
+_drain_registered = False
+
+# NOTE: from Python 3.9, thread pools refuse new work once threading shuts down, before non-daemon threads are joined
+# and atexit hooks run, so pending syncs are drained from a threading exit hook that runs before theirs
+_register_exit = getattr(threading, '_register_atexit', atexit.register)
+
+
+class SyncWorker:
+
+    def __init__(self,
+                 directory: str):
+        """
+        SyncWorker constructor.
+
+        Runs the syncs of one clone on a background thread, one at a time. Requests from the same owner that arrive
+        while a sync is in flight are coalesced into a single follow-up sync. The thread stops once no sync is pending;
+        the interpreter waits for pending syncs before exiting.
+
+        Parameters
+        ----------
+        directory: str
+            Local directory of the clone
+        """
+
+        self.__directory = directory
+        self.__pending = OrderedDict()
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+        # held while a sync runs, so syncs from other threads (e.g., a blocking sync) never overlap
+        self.lock = threading.RLock()
+
+    def submit(self,
+               owner: Hashable,
+               fn: Callable) -> Future:
+        """
+        Schedule a sync, or fold it into the sync already pending for the same owner
+
+        Parameters
+        ----------
+        owner: Hashable
+            Identity of the requester, e.g., id() of a Mizuna object
+        fn: Callable
+            Function running the sync; replaces the function of a pending request from the same owner
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future resolved with the return value of fn
+        """
+
+        with self.__condition:
+            if owner in self.__pending:
+                future, _ = self.__pending[owner]
+                verbose_print(f'[mizuna] Sync already pending for {self.__directory} -- coalescing.')
+            else:
+                future = Future()
+            self.__pending[owner] = (future, fn)
+
+            if self.__thread is None:
+                _register_drain()
+                self.__thread = threading.Thread(target=self.__run, name=f'mizuna-sync-{self.__directory}')
+                self.__thread.start()
+
+        return future
+
+    def join(self):
+        """
+        Wait until no sync is pending or running
+        """
+
+        while True:
+            with self.__condition:
+                thread = self.__thread
+            if thread is None or thread is threading.current_thread():
+                return
+            thread.join()
+
+    def __run(self):
+
+        while True:
+            with self.__condition:
+                if not self.__pending:
+                    self.__thread = None
+                    return
+                _, (future, fn) = self.__pending.popitem(last=False)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                with self.lock:
+                    result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+def _drain():
+
+    with _workers_lock:
+        workers = list(_workers.values())
+
+    for worker in workers:
+        worker.join()
+
+
+def _register_drain():
+
+    global _drain_registered
+    with _workers_lock:
+        if not _drain_registered:
+            _register_exit(_drain)
+            _drain_registered = True
+
+
+def worker_for(directory: str) -> SyncWorker:
+    """
+    Get the background sync worker of a clone, creating it on first use
+
+    Parameters
+    ----------
+    directory: str
+        Local directory of the clone
+
+    Returns
+    -------
+    SyncWorker
+        The single worker shared by every Mizuna object syncing to this clone
+    """
+
+    key = os.path.abspath(directory)
+    with _workers_lock:
+        if key not in _workers:
+            _workers[key] = SyncWorker(key)
+        return _workers[key]
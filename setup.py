@@ -19,6 +19,7 @@ setup(
     packages=find_packages(),
     python_requires='>=3.6, <4',
     # install_requires=[],
+    extras_require={'perceptual': ['numpy', 'Pillow']},
     keywords=['python', 'workflow', 'data-science',
               'latex', 'overleaf',
               'jupyter',